@@ -0,0 +1,256 @@
+"""
+    Benchmarks _repo_generator.py on a synthetic repo of configurable size
+    and prints the time spent in every phase of the Generator as JSON.
+
+    Every run builds the repo from scratch (cold) and then runs the generator
+    again on the unchanged tree (warm), which should hit the build manifest.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import cProfile
+import tempfile
+import contextlib
+
+import _repo_generator
+
+PHASES = [
+    "scan",
+    "index",
+    "fingerprint",
+    "zip",
+    "meta_copy",
+    "addons_xml",
+    "md5",
+]
+
+ADDON_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<addon id="{id}" version="{version}" name="{id}" provider-name="benchmark">
+    <requires>
+        <import addon="xbmc.python" version="3.0.0"/>
+    </requires>
+    <extension point="xbmc.python.script" library="default.py">
+        <provides>executable</provides>
+    </extension>
+    <extension point="xbmc.addon.metadata">
+        <summary>Synthetic benchmark addon</summary>
+        <platform>all</platform>
+        <assets>
+            <icon>icon.png</icon>
+        </assets>
+    </extension>
+</addon>
+"""
+
+
+def create_repo(release, addons, files, binary_ratio, file_size, seed):
+    """
+    Creates a release folder with the given number of addons, each holding
+    files spread over a few sub folders. A binary_ratio share of the files is
+    random (incompressible) data, the rest is repetitive XML.
+    """
+    rng = random.Random(seed)
+    for a in range(addons):
+        addon_id = "script.benchmark.{}".format(a)
+        addon_path = os.path.join(release, addon_id)
+        os.makedirs(addon_path)
+        with open(os.path.join(addon_path, "addon.xml"), "w") as f:
+            f.write(ADDON_XML.format(id=addon_id, version="1.0.0"))
+        with open(os.path.join(addon_path, "icon.png"), "wb") as f:
+            f.write(rng.getrandbits(8 * file_size).to_bytes(file_size, "little"))
+
+        for i in range(files):
+            folder = os.path.join(addon_path, "folder{}".format(i % 8))
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            if rng.random() < binary_ratio:
+                name = os.path.join(folder, "image{}.jpg".format(i))
+                data = rng.getrandbits(8 * file_size).to_bytes(file_size, "little")
+            else:
+                name = os.path.join(folder, "include{}.xml".format(i))
+                line = '<control type="image" id="{}"><texture>x.png</texture></control>\n'
+                data = b"".join(
+                    line.format(rng.randint(0, 99999)).encode("utf-8")
+                    for _ in range(file_size // len(line))
+                )
+            with open(name, "wb") as f:
+                f.write(data)
+
+        # Stale bytecode for the release scan to clean up
+        pycache = os.path.join(addon_path, "__pycache__")
+        os.makedirs(pycache)
+        with open(os.path.join(pycache, "default.cpython-311.pyc"), "wb") as f:
+            f.write(b"\0" * 64)
+
+
+class TimedGenerator(_repo_generator.Generator):
+    """
+    Generator that adds the wall time of every phase to self.timings.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.timings = dict.fromkeys(PHASES, 0.0)
+        super().__init__(*args, **kwargs)
+
+    @contextlib.contextmanager
+    def _timed(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[phase] += time.perf_counter() - start
+
+    def _scan_release(self):
+        with self._timed("scan"):
+            return super()._scan_release()
+
+    def _build_index(self, addons_xml_path):
+        with self._timed("index"):
+            return super()._build_index(addons_xml_path)
+
+    def _fingerprint_addon(self, folder, previous):
+        with self._timed("fingerprint"):
+            return super()._fingerprint_addon(folder, previous)
+
+    def _create_zip(self, folder, addon_id, version):
+        with self._timed("zip"):
+            return super()._create_zip(folder, addon_id, version)
+
+    def _finish_zips(self, pending):
+        with self._timed("zip"):
+            return super()._finish_zips(pending)
+
+    def _copy_meta_files(self, addon, addon_folder):
+        with self._timed("meta_copy"):
+            return super()._copy_meta_files(addon, addon_folder)
+
+    def _write_index(self):
+        with self._timed("addons_xml"):
+            return super()._write_index()
+
+    def _generate_md5_file(self, addons_xml_path, md5_path):
+        with self._timed("md5"):
+            return super()._generate_md5_file(addons_xml_path, md5_path)
+
+
+def run_generator(release, reproducible):
+    """
+    Runs the generator once, with its console output suppressed.
+    Returns the phase timings and the total wall time.
+    """
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        generator = TimedGenerator(release, reproducible=reproducible, deltas=False)
+    timings = {phase: round(t, 6) for phase, t in generator.timings.items()}
+    timings["total"] = round(time.perf_counter() - start, 6)
+    return timings
+
+
+def benchmark(args):
+    results = {
+        "config": {
+            "addons": args.addons,
+            "files": args.files,
+            "binary_ratio": args.binary_ratio,
+            "file_size": args.file_size,
+            "runs": args.runs,
+            "reproducible": args.reproducible,
+            "seed": args.seed,
+            "python": sys.version.split()[0],
+        },
+        "runs": [],
+    }
+
+    workdir = tempfile.mkdtemp(prefix="repo_benchmark_")
+    try:
+        release = os.path.join(workdir, "repo")
+        for run in range(args.runs):
+            if os.path.exists(release):
+                shutil.rmtree(release)
+            create_repo(
+                release,
+                args.addons,
+                args.files,
+                args.binary_ratio,
+                args.file_size,
+                args.seed,
+            )
+            results["runs"].append(
+                {
+                    "cold": run_generator(release, args.reproducible),
+                    "warm": run_generator(release, args.reproducible),
+                }
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for build in ["cold", "warm"]:
+        results[build] = {
+            phase: min(run[build][phase] for run in results["runs"])
+            for phase in PHASES + ["total"]
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Kodi repository generator."
+    )
+    parser.add_argument(
+        "--addons", type=int, default=4, help="number of addons (default: 4)"
+    )
+    parser.add_argument(
+        "--files", type=int, default=200, help="files per addon (default: 200)"
+    )
+    parser.add_argument(
+        "--binary-ratio",
+        type=float,
+        default=0.3,
+        help="share of incompressible files (default: 0.3)",
+    )
+    parser.add_argument(
+        "--file-size",
+        type=int,
+        default=32 * 1024,
+        help="bytes per file (default: 32768)",
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=3,
+        help="number of runs, the fastest time of every phase is reported (default: 3)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="seed for the synthetic content (default: 0)",
+    )
+    parser.add_argument(
+        "--reproducible", action="store_true", help="build reproducible zips"
+    )
+    parser.add_argument(
+        "-o", "--output", help="write the JSON results to this file instead of stdout"
+    )
+    parser.add_argument("--profile", help="write cProfile stats of all runs to this file")
+    args = parser.parse_args()
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        results = profiler.runcall(benchmark, args)
+        profiler.dump_stats(args.profile)
+    else:
+        results = benchmark(args)
+
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
@@ -4,13 +4,25 @@
     and then update the md5 and addons.xml file
 """
 
+import io
 import os
+import re
+import json
+import fnmatch
+import tempfile
+import time
+import zlib
+import argparse
 import shutil
 import hashlib
+import subprocess
 import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from xml.etree import ElementTree
 
 SCRIPT_VERSION = 2
+MANIFEST_FILE = ".build_manifest.json"
+MANIFEST_VERSION = 1
 KODI_VERSIONS = ["krypton", "leia", "matrix", "repo"]
 IGNORE = [
     ".git",
@@ -21,6 +33,26 @@ IGNORE = [
     ".idea",
     "venv",
 ]
+# Checksum sidecars written next to every zip, e.g. skin.nedflix-1.0.8.zip.sha256
+CHECKSUM_ALGORITHMS = ["md5", "sha256"]
+HASH_CHUNK_SIZE = 1024 * 1024
+# Sub folder of zips/<addon_id> holding the patches between consecutive versions
+DELTAS_FOLDER = "deltas"
+# Base name of a patch, e.g. skin.nedflix-1.0.7_to_1.0.8. Versions may hold
+# "-" (1.0.0-beta), so the two are split on "_to_" instead
+DELTA_NAME = "{}-{}_to_{}"
+# Earliest timestamp a zip entry can hold, used for reproducible builds
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+# Images are already compressed, deflating them again gains next to nothing.
+# Other binaries (fonts, videos, nested zips) are left to the entropy check
+# as some of them still shrink considerably.
+STORED_EXTENSIONS = [
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".gif",
+    ".webp",
+]
 
 
 def _setup_colors():
@@ -61,6 +93,472 @@ def color_text(text, color):
     )
 
 
+class CompressionPolicy:
+    """
+    Decides per file whether a zip entry is stored or deflated.
+
+    Files with an extension in store_extensions are stored. Other files
+    larger than sample_size are sampled: if a fast deflate of the sample
+    does not get below entropy_threshold of its size the file is stored too
+    (an entropy_threshold of 0 disables sampling). Everything else is
+    deflated with compresslevel.
+    """
+
+    def __init__(
+        self,
+        store_extensions=STORED_EXTENSIONS,
+        compresslevel=6,
+        entropy_threshold=0.95,
+        sample_size=64 * 1024,
+    ):
+        self.store_extensions = set(e.lower() for e in store_extensions)
+        self.compresslevel = compresslevel
+        self.entropy_threshold = entropy_threshold
+        self.sample_size = sample_size
+
+    def classify(self, path, size):
+        """
+        Returns the name of the rule that applies to the file.
+        """
+        if os.path.splitext(path)[1].lower() in self.store_extensions:
+            return "stored (extension)"
+
+        if self.entropy_threshold and size > self.sample_size:
+            with open(path, "rb") as f:
+                sample = f.read(self.sample_size)
+            if len(zlib.compress(sample, 1)) >= self.entropy_threshold * len(sample):
+                return "stored (entropy)"
+
+        return "deflated"
+
+    def zip_args(self, rule):
+        """
+        Returns the (compress_type, compresslevel) for a rule.
+        """
+        if rule == "deflated":
+            return zipfile.ZIP_DEFLATED, self.compresslevel
+        return zipfile.ZIP_STORED, None
+
+
+class RetentionPolicy:
+    """
+    Decides which old zips of an addon can be removed from the zips folder.
+
+    A version is kept when it is one of the keep_last newest ones, or when
+    its zip is younger than keep_days. A zip's age is taken from the last
+    commit that touched it (see _committed_times), or its mtime when it
+    hasn't been committed. Leaving a rule as None disables it;
+    with both disabled nothing is removed. The version advertised in
+    addons.xml is never removed, whatever the rules say.
+    """
+
+    def __init__(self, keep_last=None, keep_days=None, dry_run=False):
+        self.keep_last = keep_last
+        self.keep_days = keep_days
+        self.dry_run = dry_run
+
+    def expired(self, versions, advertised, now=None):
+        """
+        Takes {version: zip timestamp} and returns the versions to remove,
+        newest first.
+        """
+        if self.keep_last is None and self.keep_days is None:
+            return []
+
+        now = time.time() if now is None else now
+        ordered = sorted(versions, key=_version_key, reverse=True)
+        expired = []
+        for rank, version in enumerate(ordered):
+            if version == advertised:
+                continue
+            if self.keep_last is not None and rank < self.keep_last:
+                continue
+            if (
+                self.keep_days is not None
+                and now - versions[version] < self.keep_days * 86400
+            ):
+                continue
+            expired.append(version)
+        return expired
+
+
+class IgnoreMatcher:
+    """
+    IGNORE compiled once per run. A folder is ignored when its name equals
+    an entry, a file when its name starts with one, as before. Entries
+    holding wildcards are matched as globs against both.
+    """
+
+    def __init__(self, patterns):
+        globs = [p for p in patterns if any(c in p for c in "*?[")]
+        plain = [p for p in patterns if p not in globs]
+        self.dirs = set(plain)
+        self.prefixes = re.compile("|".join(re.escape(p) for p in plain) or "(?!)")
+        self.globs = re.compile("|".join(fnmatch.translate(g) for g in globs) or "(?!)")
+
+    def ignore_dir(self, name):
+        return name in self.dirs or self.globs.match(name) is not None
+
+    def ignore_file(self, name):
+        return (
+            self.prefixes.match(name) is not None or self.globs.match(name) is not None
+        )
+
+
+_IGNORE = IgnoreMatcher(IGNORE)
+
+
+class ScannedFile:
+    """
+    A file to package, as found by Generator._scan_release.
+    """
+
+    __slots__ = ("path", "rel", "size", "mtime_ns")
+
+    def __init__(self, path, rel, size, mtime_ns):
+        self.path = path
+        self.rel = rel
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+
+def _file_digests(path, algorithms):
+    """
+    Hashes a file in chunks with every given algorithm in a single read.
+    Returns {algorithm: hexdigest}.
+    """
+    digests = [hashlib.new(a) for a in algorithms]
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            for digest in digests:
+                digest.update(chunk)
+    return {a: d.hexdigest() for a, d in zip(algorithms, digests)}
+
+
+class _HashingWriter:
+    """
+    Write-only file object that hashes the bytes on their way to disk.
+
+    zipfile seeks back to patch the local header of the entry it has just
+    written, so everything after the last commit() is kept in memory and
+    only hashed once it is final. Committing after every entry bounds the
+    memory to the largest compressed entry.
+    """
+
+    def __init__(self, path, algorithms):
+        self.fp = open(path, "wb")
+        self.algorithms = algorithms
+        self.digests = [hashlib.new(a) for a in algorithms]
+        self.committed = 0
+        self.pending = bytearray()
+        self.pos = 0
+
+    def write(self, data):
+        offset = self.pos - self.committed
+        if offset < 0:
+            raise io.UnsupportedOperation("cannot rewrite bytes that were hashed")
+        end = offset + len(data)
+        if end > len(self.pending):
+            self.pending.extend(bytes(end - len(self.pending)))
+        self.pending[offset:end] = data
+        self.fp.write(data)
+        self.pos += len(data)
+        return len(data)
+
+    def commit(self):
+        """
+        Hashes everything written so far, it can't be rewritten after this.
+        """
+        for digest in self.digests:
+            digest.update(self.pending)
+        self.committed += len(self.pending)
+        self.pending = bytearray()
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.committed + len(self.pending)
+        self.pos = offset
+        self.fp.seek(offset)
+        return offset
+
+    def tell(self):
+        return self.pos
+
+    def seekable(self):
+        return True
+
+    def truncate(self, size=None):
+        size = self.pos if size is None else size
+        del self.pending[max(size - self.committed, 0):]
+        return self.fp.truncate(size)
+
+    def flush(self):
+        self.fp.flush()
+
+    def close(self):
+        self.commit()
+        self.fp.close()
+
+    def hexdigests(self):
+        return {a: d.hexdigest() for a, d in zip(self.algorithms, self.digests)}
+
+
+def _reproducible_date_time():
+    """
+    Returns the timestamp given to every entry of a reproducible zip:
+    SOURCE_DATE_EPOCH when set, otherwise the earliest date a zip can hold.
+    """
+    epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    if epoch:
+        return max(time.gmtime(int(epoch))[:6], ZIP_EPOCH)
+    return ZIP_EPOCH
+
+
+def _write_zip(
+    folder,
+    files,
+    final_zip,
+    policy,
+    reproducible=False,
+    algorithms=CHECKSUM_ALGORITHMS,
+):
+    """
+    Zips the scanned files of an addon folder following the compression
+    policy, under the folder name. Kept at module level so it can run in a
+    worker process.
+
+    Entries are written in the (sorted) scan order. When reproducible is set the
+    timestamps, permissions and creating system of every entry are fixed as
+    well, so an identical source tree always gives a byte-identical zip.
+
+    The zip is hashed while it is written and a checksum sidecar is saved
+    next to it for every algorithm, without reading the zip back.
+
+    Returns the size of the zip and, per policy rule, the number of files,
+    their size before and after compression and the CPU time spent.
+    """
+    date_time = _reproducible_date_time() if reproducible else None
+    stats = {}
+    out = _HashingWriter(final_zip, algorithms)
+    zip = zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED)
+
+    for f in files:
+        archive_name = folder + "/" + f.rel
+
+        start = time.process_time()
+        rule = policy.classify(f.path, f.size)
+        compress_type, compresslevel = policy.zip_args(rule)
+        if reproducible:
+            zinfo = zipfile.ZipInfo(archive_name, date_time)
+            zinfo.create_system = 3
+            zinfo.external_attr = 0o100644 << 16
+            # What writestr() sets, but streamed instead of read into memory
+            zinfo.compress_type = compress_type
+            zinfo._compresslevel = compresslevel
+            zinfo.file_size = f.size
+            with open(f.path, "rb") as src, zip.open(zinfo, "w") as dst:
+                shutil.copyfileobj(src, dst)
+        else:
+            zip.write(f.path, archive_name, compress_type, compresslevel)
+        out.commit()
+        info = zip.infolist()[-1]
+
+        rule_stats = stats.setdefault(rule, [0, 0, 0, 0.0])
+        rule_stats[0] += 1
+        rule_stats[1] += info.file_size
+        rule_stats[2] += info.compress_size
+        rule_stats[3] += time.process_time() - start
+
+    zip.close()
+    out.close()
+    for algorithm, hexdigest in out.hexdigests().items():
+        with open("{}.{}".format(final_zip, algorithm), "w") as f:
+            f.write(hexdigest)
+    return out.pos, stats
+
+
+def _committed_times(folder):
+    """
+    Returns {path: time of the last commit} for the files under folder that
+    are committed to git, with paths relative to folder. Checkouts and clones
+    reset file mtimes, commit dates survive them. Empty when git isn't
+    available or folder isn't in a checkout.
+    """
+    try:
+        output = subprocess.run(
+            ["git", "log", "--format=%x00%ct", "--name-only", "--relative", "--", "."],
+            cwd=folder,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {}
+
+    times = {}
+    committed = None
+    for line in output.splitlines():
+        if line.startswith("\0"):
+            committed = float(line[1:])
+        elif line and committed is not None:
+            # Newest commits come first
+            times.setdefault(line, committed)
+    return times
+
+
+def _version_key(version):
+    """
+    Sort key for addon versions, comparing the numeric parts as numbers.
+    """
+    return [
+        (0, int(part), "") if part.isdigit() else (1, 0, part)
+        for part in re.split(r"[.\-+~]", version)
+    ]
+
+
+def _entry_digests(zip_path):
+    """
+    Returns {entry name: sha256 of its uncompressed content} for a zip.
+    """
+    digests = {}
+    with zipfile.ZipFile(zip_path) as z:
+        for info in z.infolist():
+            if info.is_dir():
+                continue
+            digest = hashlib.sha256()
+            with z.open(info) as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            digests[info.filename] = digest.hexdigest()
+    return digests
+
+
+def _write_delta(old_zip, new_zip, delta_path, patch_path):
+    """
+    Compares two versions of an addon zip by the content hash of every entry
+    and writes a delta manifest listing the added, changed and removed
+    entries, plus a patch zip holding only the added and changed ones.
+    Kept at module level so it can run in a worker process.
+
+    Returns the delta manifest.
+    """
+    old = _entry_digests(old_zip)
+    new = _entry_digests(new_zip)
+    delta = {
+        "from": _file_digests(old_zip, ["sha256"])["sha256"],
+        "to": _file_digests(new_zip, ["sha256"])["sha256"],
+        "added": {n: d for n, d in sorted(new.items()) if n not in old},
+        "changed": {n: d for n, d in sorted(new.items()) if n in old and old[n] != d},
+        "removed": sorted(n for n in old if n not in new),
+    }
+
+    with zipfile.ZipFile(new_zip) as src, zipfile.ZipFile(patch_path, "w") as patch:
+        for name in list(delta["added"]) + list(delta["changed"]):
+            info = src.getinfo(name)
+            patch.writestr(info, src.read(info), info.compress_type)
+
+    with open(delta_path, "w", encoding="utf-8") as f:
+        json.dump(delta, f, indent=4)
+    return delta
+
+
+def apply_patch(old_zip, patch_zip, delta_path, out_zip):
+    """
+    Rebuilds the newer version of an addon zip from the older zip, the patch
+    zip and the delta manifest written by _write_delta.
+    """
+    with open(delta_path, "r", encoding="utf-8") as f:
+        delta = json.load(f)
+
+    if _file_digests(old_zip, ["sha256"])["sha256"] != delta["from"]:
+        raise ValueError("{} is not the zip this patch was made from".format(old_zip))
+
+    removed = set(delta["removed"]) | set(delta["changed"])
+    with zipfile.ZipFile(old_zip) as old, zipfile.ZipFile(
+        patch_zip
+    ) as patch, zipfile.ZipFile(out_zip, "w") as out:
+        for info in old.infolist():
+            if info.filename not in removed:
+                out.writestr(info, old.read(info), info.compress_type)
+        for info in patch.infolist():
+            out.writestr(info, patch.read(info), info.compress_type)
+
+
+def _parse_delta_name(addon_id, name):
+    """
+    Returns (old version, new version, extension) of a patch file name
+    from DELTA_NAME, or None if the name isn't one.
+    """
+    match = re.match(
+        r"^{}-(.+)_to_(.+)\.(json|zip)$".format(re.escape(addon_id)), name
+    )
+    return match.groups() if match else None
+
+
+def verify_patch(old_zip, patch_zip, delta_path, new_zip):
+    """
+    Rebuilds the newer zip from the older one and the patch in a temporary
+    file and checks every entry against the real newer zip.
+    Returns the names of the entries that differ.
+    """
+    fd, rebuilt = tempfile.mkstemp(suffix=".zip")
+    os.close(fd)
+    try:
+        apply_patch(old_zip, patch_zip, delta_path, rebuilt)
+        expected = _entry_digests(new_zip)
+        actual = _entry_digests(rebuilt)
+    finally:
+        os.remove(rebuilt)
+
+    return sorted(
+        name
+        for name in set(expected) | set(actual)
+        if expected.get(name) != actual.get(name)
+    )
+
+
+def verify_deltas(release):
+    """
+    Verifies every patch in the zips folder of a release against the zips
+    it was made from and for. Returns True if all of them rebuild correctly.
+    """
+    zips_path = os.path.join(release, "zips")
+    ok = True
+    for addon_id in sorted(os.listdir(zips_path)) if os.path.isdir(zips_path) else []:
+        deltas_path = os.path.join(zips_path, addon_id, DELTAS_FOLDER)
+        if not os.path.isdir(deltas_path):
+            continue
+        for name in sorted(os.listdir(deltas_path)):
+            parsed = _parse_delta_name(addon_id, name)
+            if parsed is None or parsed[2] != "json":
+                continue
+            old_version, new_version, _ = parsed
+            zip_name = os.path.join(zips_path, addon_id, addon_id + "-{}.zip")
+            old_zip = zip_name.format(old_version)
+            new_zip = zip_name.format(new_version)
+            delta_path = os.path.join(deltas_path, name)
+            patch_zip = delta_path[: -len(".json")] + ".zip"
+            label = "{} ({} -> {})".format(
+                color_text(addon_id, 'cyan'),
+                color_text(old_version, 'green'),
+                color_text(new_version, 'green'),
+            )
+            try:
+                differences = verify_patch(old_zip, patch_zip, delta_path, new_zip)
+            except Exception as e:
+                differences = [str(e)]
+            if differences:
+                ok = False
+                print("Patch FAILED for {}:".format(label))
+                for difference in differences:
+                    print("    {}".format(color_text(difference, 'red')))
+            else:
+                print("Patch verified for {}".format(label))
+    return ok
+
+
 def convert_bytes(num):
     """
     this function will convert bytes to MB.... GB... etc
@@ -71,6 +569,103 @@ def convert_bytes(num):
         num /= 1024.0
 
 
+class AddonInfo:
+    """
+    An addon found in a release folder, with everything the generator needs
+    from its addon.xml.
+    """
+
+    def __init__(self, release_path, folder):
+        self.folder = folder
+        self.path = os.path.join(release_path, folder)
+        self.root = ElementTree.parse(os.path.join(self.path, "addon.xml")).getroot()
+        self.id = self.root.get('id')
+        self.version = self.root.get('version')
+
+        self.assets = []
+        for ext in self.root.findall("extension"):
+            if ext.get("point") in ["xbmc.addon.metadata", "kodi.addon.metadata"]:
+                assets = ext.find("assets")
+                if not assets:
+                    continue
+                for art in [a for a in assets if a.text]:
+                    self.assets.append(os.path.normpath(art.text))
+
+
+class RepositoryIndex:
+    """
+    The addons of a release and the entries of its addons.xml, indexed by
+    addon id. Built once per run, so every addon.xml is parsed exactly once
+    and every lookup is a dict access.
+    """
+
+    def __init__(self, release_path, addons_xml_path):
+        self.addons_xml_path = addons_xml_path
+        self.dirty = False
+
+        if not os.path.exists(addons_xml_path):
+            self.addons_xml = ElementTree.ElementTree(ElementTree.Element('addons'))
+        else:
+            self.addons_xml = ElementTree.parse(addons_xml_path)
+        self.published = {
+            addon.get('id'): addon for addon in self.addons_xml.getroot()
+        }
+
+        self.addons = {}
+        for folder in sorted(os.listdir(release_path)):
+            if (
+                not os.path.isdir(os.path.join(release_path, folder))
+                or folder == "zips"
+                or folder.startswith(".")
+                or not os.path.exists(os.path.join(release_path, folder, "addon.xml"))
+            ):
+                continue
+            try:
+                addon = AddonInfo(release_path, folder)
+            except Exception as e:
+                print(
+                    "Excluding {}: {}".format(
+                        color_text(folder, 'yellow'), color_text(e, 'red')
+                    )
+                )
+                continue
+            if addon.id in self.addons:
+                print(
+                    "Excluding {}: {} is already provided by {}".format(
+                        color_text(folder, 'yellow'),
+                        color_text(addon.id, 'red'),
+                        color_text(self.addons[addon.id].folder, 'yellow'),
+                    )
+                )
+                continue
+            self.addons[addon.id] = addon
+
+    def published_version(self, addon_id):
+        """
+        Returns the version of the addon in addons.xml, or None.
+        """
+        entry = self.published.get(addon_id)
+        return entry.get('version') if entry is not None else None
+
+    def publish(self, addon):
+        """
+        Replaces (or adds) the addons.xml entry of an addon with its addon.xml.
+        """
+        self.published[addon.id] = addon.root
+        self.dirty = True
+
+    def write(self):
+        """
+        Writes addons.xml with the entries sorted by addon id.
+        """
+        root = self.addons_xml.getroot()
+        root[:] = [self.published[id] for id in sorted(self.published)]
+        self.addons_xml.write(
+            self.addons_xml_path, encoding="utf-8", xml_declaration=True
+        )
+        self.dirty = False
+
+
 class Generator:
     """
     Generates a new addons.xml file from each addons addon.xml file
@@ -78,16 +673,35 @@ class Generator:
     the checked-out repo.
     """
 
-    def __init__(self, release):
+    def __init__(
+        self,
+        release,
+        executor=None,
+        policy=None,
+        reproducible=False,
+        algorithms=CHECKSUM_ALGORITHMS,
+        deltas=True,
+        retention=None,
+    ):
         self.release_path = release
+        self.deltas = deltas
+        self.retention = retention
+        self.executor = executor
+        self.reproducible = reproducible
+        self.algorithms = algorithms
+        self.policy = policy or CompressionPolicy()
+        self.compression_stats = {}
         self.zips_path = os.path.join(self.release_path, "zips")
         addons_xml_path = os.path.join(self.zips_path, "addons.xml")
         md5_path = os.path.join(self.zips_path, "addons.xml.md5")
 
+        self.manifest_path = os.path.join(self.release_path, MANIFEST_FILE)
+
         if not os.path.exists(self.zips_path):
             os.makedirs(self.zips_path)
 
-        self._remove_binaries()
+        self.tree = self._scan_release()
+        self._load_manifest()
 
         if self._generate_addons_file(addons_xml_path):
             print(
@@ -97,111 +711,401 @@ class Generator:
             if self._generate_md5_file(addons_xml_path, md5_path):
                 print("Successfully updated {}".format(color_text(md5_path, 'yellow')))
 
-    def _remove_binaries(self):
-        """
-        Removes any and all compiled Python files before operations.
-        """
-
-        for parent, dirnames, filenames in os.walk(self.release_path):
-            for fn in filenames:
-                if fn.lower().endswith("pyo") or fn.lower().endswith("pyc"):
-                    compiled = os.path.join(parent, fn)
-                    try:
-                        os.remove(compiled)
-                        print(
-                            "Removed compiled python file: {}".format(
-                                color_text(compiled, 'green')
-                            )
-                        )
-                    except:
-                        print(
-                            "Failed to remove compiled python file: {}".format(
-                                color_text(compiled, 'red')
-                            )
-                        )
-            for dir in dirnames:
-                if "pycache" in dir.lower():
-                    compiled = os.path.join(parent, dir)
-                    try:
-                        shutil.rmtree(compiled)
-                        print(
-                            "Removed __pycache__ cache folder: {}".format(
-                                color_text(compiled, 'green')
-                            )
-                        )
-                    except:
-                        print(
-                            "Failed to remove __pycache__ cache folder:  {}".format(
-                                color_text(compiled, 'red')
-                            )
-                        )
+        if self.retention is not None:
+            self._prune_zips(addons_xml_path)
+
+        self._save_manifest()
+
+    def _load_manifest(self):
+        """
+        Loads the build manifest holding the per-file hashes of every addon
+        as it was last packaged.
+        """
+        self.manifest = {"version": MANIFEST_VERSION, "addons": {}}
+        self.manifest_changed = False
+        if not os.path.exists(self.manifest_path):
+            return
+
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION:
+                self.manifest = manifest
+        except Exception as e:
+            print(
+                "Ignoring unreadable build manifest {}: {}".format(
+                    color_text(self.manifest_path, 'yellow'), color_text(e, 'red')
+                )
+            )
+
+    def _save_manifest(self):
+        """
+        Writes the build manifest back to disk if anything was recorded.
+        """
+        if self.manifest_changed:
+            self._save_file(
+                json.dumps(self.manifest, sort_keys=True),
+                file=self.manifest_path,
+            )
+
+    def _hash_file(self, path):
+        """
+        Returns the sha256 of a file, read in chunks.
+        """
+        return _file_digests(path, ["sha256"])["sha256"]
+
+    def _fingerprint_addon(self, folder, previous):
+        """
+        Returns {relative path: [size, mtime_ns, sha256]} for the packaged files
+        of an addon folder. Only files whose size or mtime differ from the
+        previous manifest entry are read and hashed again.
+        """
+        files = {}
+        for f in self.tree.get(folder, []):
+            known = previous.get(f.rel)
+            if known and known[0] == f.size and known[1] == f.mtime_ns:
+                files[f.rel] = known
+            else:
+                files[f.rel] = [f.size, f.mtime_ns, self._hash_file(f.path)]
+        return files
+
+    def _report_unbumped(self, addon_id, version, previous, files):
+        """
+        Prints the files that changed since the zip for this version was built.
+        """
+        old = {rel: rec[2] for rel, rec in previous.items()}
+        new = {rel: rec[2] for rel, rec in files.items()}
+        if old == new:
+            return False
+
+        changes = sorted(
+            [(rel, "added") for rel in new if rel not in old]
+            + [(rel, "removed") for rel in old if rel not in new]
+            + [(rel, "changed") for rel in new if rel in old and new[rel] != old[rel]]
+        )
+        print(
+            "{} ({}) has {} changed file(s) but its version was not bumped:".format(
+                color_text(addon_id, 'cyan'),
+                color_text(version, 'green'),
+                color_text(len(changes), 'red'),
+            )
+        )
+        for rel, kind in changes:
+            print("    {} {}".format(kind, color_text(rel, 'yellow')))
+        return True
+
+    def _scan_release(self):
+        """
+        Walks the release once with scandir. Compiled Python files and
+        __pycache__ folders are removed as they are found, ignored entries
+        are skipped without being descended into, and everything else is
+        returned as {addon folder: [ScannedFile]}, in sorted order.
+        """
+        tree = {}
+        with os.scandir(self.release_path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if "pycache" in entry.name.lower():
+                    self._remove_compiled(entry.path, "__pycache__ cache folder")
+                elif entry.name != "zips" and not entry.name.startswith("."):
+                    files = tree[entry.name] = []
+                    self._scan_folder(entry.path, "", files)
+            elif entry.name.lower().endswith(("pyo", "pyc")):
+                self._remove_compiled(entry.path, "compiled python file")
+        return tree
+
+    def _scan_folder(self, path, rel, files):
+        """
+        Adds the files to package below path to files, depth first with the
+        files of a folder before its sub folders.
+        """
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+
+        folders = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if "pycache" in entry.name.lower():
+                    self._remove_compiled(entry.path, "__pycache__ cache folder")
+                elif not _IGNORE.ignore_dir(entry.name):
+                    folders.append(entry)
+            elif entry.name.lower().endswith(("pyo", "pyc")):
+                self._remove_compiled(entry.path, "compiled python file")
+            elif not _IGNORE.ignore_file(entry.name):
+                st = entry.stat()
+                files.append(
+                    ScannedFile(entry.path, rel + entry.name, st.st_size, st.st_mtime_ns)
+                )
+
+        for entry in folders:
+            self._scan_folder(entry.path, rel + entry.name + "/", files)
+
+    def _remove_compiled(self, path, kind):
+        """
+        Removes a compiled Python file or __pycache__ folder.
+        """
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            print("Removed {}: {}".format(kind, color_text(path, 'green')))
+        except:
+            print("Failed to remove {}: {}".format(kind, color_text(path, 'red')))
+
+    def _zip_path(self, addon_id, version):
+        """
+        Returns the path of the zip for the given addon version.
+        """
+        return os.path.join(
+            self.zips_path, addon_id, "{0}-{1}.zip".format(addon_id, version)
+        )
 
     def _create_zip(self, folder, addon_id, version):
         """
         Creates a zip file in the zips directory for the given addon.
+        Returns a Future holding the zip size, or None if it already exists.
         """
-        addon_folder = os.path.join(self.release_path, folder)
         zip_folder = os.path.join(self.zips_path, addon_id)
         if not os.path.exists(zip_folder):
             os.makedirs(zip_folder)
 
-        final_zip = os.path.join(zip_folder, "{0}-{1}.zip".format(addon_id, version))
+        final_zip = self._zip_path(addon_id, version)
         if not os.path.exists(final_zip):
-            zip = zipfile.ZipFile(final_zip, "w", compression=zipfile.ZIP_DEFLATED)
-            root_len = len(os.path.dirname(os.path.abspath(addon_folder)))
-
-            for root, dirs, files in os.walk(addon_folder):
-                # remove any unneeded artifacts
-                for i in IGNORE:
-                    if i in dirs:
-                        try:
-                            dirs.remove(i)
-                        except:
-                            pass
-                    for f in files:
-                        if f.startswith(i):
-                            try:
-                                files.remove(f)
-                            except:
-                                pass
-
-                archive_root = os.path.abspath(root)[root_len:]
-
-                for f in files:
-                    fullpath = os.path.join(root, f)
-                    archive_name = os.path.join(archive_root, f)
-                    zip.write(fullpath, archive_name, zipfile.ZIP_DEFLATED)
-
-            zip.close()
-            size = convert_bytes(os.path.getsize(final_zip))
+            return self._submit(
+                _write_zip,
+                folder,
+                self.tree.get(folder, []),
+                final_zip,
+                self.policy,
+                self.reproducible,
+                self.algorithms,
+            )
+
+    def _submit(self, fn, *args):
+        """
+        Runs fn in the process pool if there is one, otherwise right away.
+        Either way a Future is returned.
+        """
+        if self.executor is not None:
+            return self.executor.submit(fn, *args)
+
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _finish_zips(self, pending):
+        """
+        Waits for the submitted zips and reports them in addon id order.
+        """
+        pending_deltas = []
+        for addon_id, version, future in sorted(pending, key=lambda p: p[0]):
+            try:
+                size, stats = future.result()
+                size = convert_bytes(size)
+                for rule, rule_stats in stats.items():
+                    totals = self.compression_stats.setdefault(rule, [0, 0, 0, 0.0])
+                    for i, value in enumerate(rule_stats):
+                        totals[i] += value
+                print(
+                    "Zip created for {} ({}) - {}".format(
+                        color_text(addon_id, 'cyan'),
+                        color_text(version, 'green'),
+                        color_text(size, 'yellow'),
+                    )
+                )
+                if self.deltas:
+                    delta = self._create_delta(addon_id, version)
+                    if delta is not None:
+                        pending_deltas.append(delta)
+            except Exception as e:
+                final_zip = self._zip_path(addon_id, version)
+                for path in [final_zip] + [
+                    "{}.{}".format(final_zip, a) for a in self.algorithms
+                ]:
+                    if os.path.exists(path):
+                        os.remove(path)
+                self.manifest["addons"].pop(addon_id, None)
+                print(
+                    "Excluding {}: {}".format(
+                        color_text(addon_id, 'yellow'), color_text(e, 'red')
+                    )
+                )
+
+        self._report_compression()
+        self._finish_deltas(pending_deltas)
+
+    def _previous_version(self, addon_id, version):
+        """
+        Returns the highest version below the given one that has a zip.
+        """
+        zip_folder = os.path.join(self.zips_path, addon_id)
+        pattern = re.compile(r"^{}-(.+)\.zip$".format(re.escape(addon_id)))
+        versions = [
+            m.group(1)
+            for m in (pattern.match(f) for f in os.listdir(zip_folder))
+            if m and _version_key(m.group(1)) < _version_key(version)
+        ]
+        return max(versions, key=_version_key) if versions else None
+
+    def _delta_paths(self, addon_id, old_version, new_version):
+        """
+        Returns the paths of the delta manifest and patch zip between two versions.
+        """
+        base = os.path.join(
+            self.zips_path,
+            addon_id,
+            DELTAS_FOLDER,
+            DELTA_NAME.format(addon_id, old_version, new_version),
+        )
+        return base + ".json", base + ".zip"
+
+    def _create_delta(self, addon_id, version):
+        """
+        Submits the patch from the previous version of an addon to this one.
+        Returns (addon_id, old version, version, future), or None if there is
+        no previous version.
+        """
+        old_version = self._previous_version(addon_id, version)
+        if old_version is None:
+            return None
+
+        delta_path, patch_path = self._delta_paths(addon_id, old_version, version)
+        if not os.path.exists(os.path.dirname(delta_path)):
+            os.makedirs(os.path.dirname(delta_path))
+        future = self._submit(
+            _write_delta,
+            self._zip_path(addon_id, old_version),
+            self._zip_path(addon_id, version),
+            delta_path,
+            patch_path,
+        )
+        return addon_id, old_version, version, future
+
+    def _finish_deltas(self, pending):
+        """
+        Waits for the submitted patches and reports them.
+        """
+        for addon_id, old_version, version, future in pending:
+            delta_path, patch_path = self._delta_paths(addon_id, old_version, version)
+            try:
+                delta = future.result()
+                print(
+                    "Patch created for {} ({} -> {}): {} added, {} changed, {} removed - {}".format(
+                        color_text(addon_id, 'cyan'),
+                        color_text(old_version, 'green'),
+                        color_text(version, 'green'),
+                        len(delta["added"]),
+                        len(delta["changed"]),
+                        len(delta["removed"]),
+                        color_text(convert_bytes(os.path.getsize(patch_path)), 'yellow'),
+                    )
+                )
+            except Exception as e:
+                for path in [delta_path, patch_path]:
+                    if os.path.exists(path):
+                        os.remove(path)
+                print(
+                    "Failed to create patch for {}: {}".format(
+                        color_text(addon_id, 'yellow'), color_text(e, 'red')
+                    )
+                )
+
+    def _prune_zips(self, addons_xml_path):
+        """
+        Removes the zips, checksum sidecars and patches of old versions
+        according to the retention policy. Nothing is touched for an addon
+        that isn't listed in addons.xml, or at all if it couldn't be written.
+        """
+        if self.index.dirty:
             print(
-                "Zip created for {} ({}) - {}".format(
-                    color_text(addon_id, 'cyan'),
-                    color_text(version, 'green'),
-                    color_text(size, 'yellow'),
+                "Not pruning, {} is out of date".format(
+                    color_text(addons_xml_path, 'yellow')
                 )
             )
+            return
+
+        advertised = {
+            id: self.index.published_version(id) for id in self.index.published
+        }
+
+        action = "Would remove" if self.retention.dry_run else "Removed"
+        for addon_id in sorted(os.listdir(self.zips_path)):
+            zip_folder = os.path.join(self.zips_path, addon_id)
+            if addon_id not in advertised or not os.path.isdir(zip_folder):
+                continue
+
+            pattern = re.compile(r"^{}-(.+)\.zip$".format(re.escape(addon_id)))
+            committed = _committed_times(zip_folder)
+            versions = {}
+            for f in os.listdir(zip_folder):
+                match = pattern.match(f)
+                if match:
+                    versions[match.group(1)] = committed.get(f) or os.path.getmtime(
+                        os.path.join(zip_folder, f)
+                    )
+
+            expired = self.retention.expired(versions, advertised[addon_id])
+            if not expired:
+                continue
+
+            final_zips = [self._zip_path(addon_id, v) for v in expired]
+            # Sidecars of the chosen hashes, and of the defaults an earlier run may have written
+            algorithms = sorted(set(self.algorithms) | set(CHECKSUM_ALGORITHMS))
+            paths = final_zips + [
+                "{}.{}".format(z, a) for z in final_zips for a in algorithms
+            ]
+            deltas_path = os.path.join(zip_folder, DELTAS_FOLDER)
+            if os.path.isdir(deltas_path):
+                for f in os.listdir(deltas_path):
+                    parsed = _parse_delta_name(addon_id, f)
+                    if parsed and (parsed[0] in expired or parsed[1] in expired):
+                        paths.append(os.path.join(deltas_path, f))
+
+            for path in sorted(p for p in paths if os.path.exists(p)):
+                size = convert_bytes(os.path.getsize(path))
+                if not self.retention.dry_run:
+                    os.remove(path)
+                print(
+                    "{} {} - {}".format(
+                        action, color_text(path, 'yellow'), color_text(size, 'green')
+                    )
+                )
 
-    def _copy_meta_files(self, addon_id, addon_folder):
+    def _report_compression(self):
         """
-        Copy the addon.xml and relevant art files into the relevant folders in the repository.
+        Prints the bytes saved and CPU time spent per compression rule.
         """
+        if not self.compression_stats:
+            return
 
-        tree = ElementTree.parse(os.path.join(self.release_path, addon_id, "addon.xml"))
-        root = tree.getroot()
-
-        copyfiles = ["addon.xml"]
-        for ext in root.findall("extension"):
-            if ext.get("point") in ["xbmc.addon.metadata", "kodi.addon.metadata"]:
-                assets = ext.find("assets")
-                if not assets:
-                    continue
-                for art in [a for a in assets if a.text]:
-                    copyfiles.append(os.path.normpath(art.text))
+        print(
+            "Compression report for {}:".format(color_text(self.release_path, 'yellow'))
+        )
+        for rule, (count, size, compressed, cpu) in sorted(
+            self.compression_stats.items()
+        ):
+            print(
+                "    {}: {} files, {} -> {}, saved {} in {:.2f}s CPU".format(
+                    color_text(rule, 'cyan'),
+                    count,
+                    convert_bytes(size),
+                    convert_bytes(compressed),
+                    color_text(convert_bytes(size - compressed), 'green'),
+                    cpu,
+                )
+            )
 
-        src_folder = os.path.join(self.release_path, addon_id)
-        for file in copyfiles:
-            addon_path = os.path.join(src_folder, file)
+    def _copy_meta_files(self, addon, addon_folder):
+        """
+        Copy the addon.xml and relevant art files into the relevant folders in the repository.
+        """
+        for file in ["addon.xml"] + addon.assets:
+            addon_path = os.path.join(addon.path, file)
             if not os.path.exists(addon_path):
                 continue
 
@@ -212,53 +1116,65 @@ class Generator:
 
             shutil.copy(addon_path, zips_path)
 
+    def _build_index(self, addons_xml_path):
+        """
+        Parses every addon.xml of the release and the current addons.xml.
+        """
+        return RepositoryIndex(self.release_path, addons_xml_path)
+
+    def _write_index(self):
+        """
+        Writes addons.xml from the index.
+        """
+        self.index.write()
+
     def _generate_addons_file(self, addons_xml_path):
         """
         Generates a zip for each found addon, and updates the addons.xml file accordingly.
         """
-        if not os.path.exists(addons_xml_path):
-            addons_root = ElementTree.Element('addons')
-            addons_xml = ElementTree.ElementTree(addons_root)
-        else:
-            addons_xml = ElementTree.parse(addons_xml_path)
-            addons_root = addons_xml.getroot()
-
-        folders = [
-            i
-            for i in os.listdir(self.release_path)
-            if os.path.isdir(os.path.join(self.release_path, i))
-            and i != "zips"
-            and not i.startswith(".")
-            and os.path.exists(os.path.join(self.release_path, i, "addon.xml"))
-        ]
+        index = self.index = self._build_index(addons_xml_path)
 
-        addon_xpath = "addon[@id='{}']"
         changed = False
-        for addon in folders:
+        pending = []
+        for id, addon in sorted(index.addons.items()):
+            version = addon.version
             try:
-                addon_xml_path = os.path.join(self.release_path, addon, "addon.xml")
-                addon_xml = ElementTree.parse(addon_xml_path)
-                addon_root = addon_xml.getroot()
-                id = addon_root.get('id')
-                version = addon_root.get('version')
-
-                updated = False
-                addon_entry = addons_root.find(addon_xpath.format(id))
-                if addon_entry is not None and addon_entry.get('version') != version:
-                    index = addons_root.findall('addon').index(addon_entry)
-                    addons_root.remove(addon_entry)
-                    addons_root.insert(index, addon_root)
-                    updated = True
-                    changed = True
-                elif addon_entry is None:
-                    addons_root.append(addon_root)
-                    updated = True
+                published = index.published_version(id)
+
+                previous = self.manifest["addons"].get(id)
+                if previous and previous["version"] != version:
+                    previous = None
+                files = self._fingerprint_addon(
+                    addon.folder, previous["files"] if previous else {}
+                )
+                if (
+                    previous
+                    and published == version
+                    and os.path.exists(self._zip_path(id, version))
+                ):
+                    # Already published: nothing to zip, only report drift and
+                    # remember new timestamps so unchanged files aren't rehashed
+                    if not self._report_unbumped(id, version, previous["files"], files):
+                        if files != previous["files"]:
+                            previous["files"] = files
+                            self.manifest_changed = True
+                    continue
+
+                if published != version:
+                    index.publish(addon)
                     changed = True
 
-                if updated:
                     # Create the zip files
-                    self._create_zip(addon, id, version)
+                    future = self._create_zip(addon.folder, id, version)
+                    if future is not None:
+                        pending.append((id, version, future))
                     self._copy_meta_files(addon, os.path.join(self.zips_path, id))
+
+                if not previous or not self._report_unbumped(
+                    id, version, previous["files"], files
+                ):
+                    self.manifest["addons"][id] = {"version": version, "files": files}
+                    self.manifest_changed = True
             except Exception as e:
                 print(
                     "Excluding {}: {}".format(
@@ -266,12 +1182,11 @@ class Generator:
                     )
                 )
 
+        self._finish_zips(pending)
+
         if changed:
-            addons_root[:] = sorted(addons_root, key=lambda addon: addon.get('id'))
             try:
-                addons_xml.write(
-                    addons_xml_path, encoding="utf-8", xml_declaration=True
-                )
+                self._write_index()
 
                 return changed
             except Exception as e:
@@ -286,9 +1201,7 @@ class Generator:
         Generates a new addons.xml.md5 file.
         """
         try:
-            m = hashlib.md5(
-                open(addons_xml_path, "r", encoding="utf-8").read().encode("utf-8")
-            ).hexdigest()
+            m = _file_digests(addons_xml_path, ["md5"])["md5"]
             self._save_file(m, file=md5_path)
 
             return True
@@ -314,5 +1227,111 @@ class Generator:
 
 
 if __name__ == "__main__":
-    for release in [r for r in KODI_VERSIONS if os.path.exists(r)]:
-        Generator(release)
+    parser = argparse.ArgumentParser(description="Generate the Kodi repository zips.")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of processes used to compress addons (default: 1)",
+    )
+    parser.add_argument(
+        "--compresslevel",
+        type=int,
+        default=6,
+        choices=range(0, 10),
+        metavar="0-9",
+        help="deflate level used for compressible files (default: 6)",
+    )
+    parser.add_argument(
+        "--store-ext",
+        default=",".join(STORED_EXTENSIONS),
+        help="comma separated extensions stored without compression",
+    )
+    parser.add_argument(
+        "--entropy-threshold",
+        type=float,
+        default=0.95,
+        help="store files whose sample deflates to more than this ratio, 0 disables (default: 0.95)",
+    )
+    parser.add_argument(
+        "--reproducible",
+        action="store_true",
+        help="normalize timestamps and permissions so identical sources give identical zips",
+    )
+    parser.add_argument(
+        "--hashes",
+        default=",".join(CHECKSUM_ALGORITHMS),
+        help="comma separated checksum sidecars written for every zip (default: md5,sha256)",
+    )
+    parser.add_argument(
+        "--no-deltas",
+        action="store_true",
+        help="don't write patches from the previous version of each new zip",
+    )
+    parser.add_argument(
+        "--verify-deltas",
+        action="store_true",
+        help="only check that every patch rebuilds the zip it was made for",
+    )
+    parser.add_argument(
+        "--keep-last",
+        type=int,
+        help="remove all but the newest N zips of every addon",
+    )
+    parser.add_argument(
+        "--keep-days",
+        type=float,
+        help="remove zips older than N days, unless kept by --keep-last "
+        "(age from the zip's last git commit, or its file mtime if uncommitted)",
+    )
+    parser.add_argument(
+        "--prune-dry-run",
+        action="store_true",
+        help="only print the zips --keep-last/--keep-days would remove",
+    )
+    args = parser.parse_args()
+    algorithms = [a.strip() for a in args.hashes.split(",") if a.strip()]
+    retention = None
+    if args.keep_last is not None or args.keep_days is not None:
+        retention = RetentionPolicy(args.keep_last, args.keep_days, args.prune_dry_run)
+    policy = CompressionPolicy(
+        store_extensions=[e.strip() for e in args.store_ext.split(",") if e.strip()],
+        compresslevel=args.compresslevel,
+        entropy_threshold=args.entropy_threshold,
+    )
+
+    releases = [r for r in KODI_VERSIONS if os.path.exists(r)]
+    if args.verify_deltas:
+        results = [verify_deltas(release) for release in releases]
+        raise SystemExit(0 if all(results) else 1)
+
+    if args.jobs > 1:
+        # Releases are driven from threads, the zlib work of every release
+        # goes to one shared process pool
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            with ThreadPoolExecutor(max_workers=len(releases) or 1) as threads:
+                for future in [
+                    threads.submit(
+                        Generator,
+                        release,
+                        executor,
+                        policy,
+                        args.reproducible,
+                        algorithms,
+                        not args.no_deltas,
+                        retention,
+                    )
+                    for release in releases
+                ]:
+                    future.result()
+    else:
+        for release in releases:
+            Generator(
+                release,
+                policy=policy,
+                reproducible=args.reproducible,
+                algorithms=algorithms,
+                deltas=not args.no_deltas,
+                retention=retention,
+            )
@@ -0,0 +1,108 @@
+import xbmc
+import xbmcgui
+import json
+import time
+import threading
+import contextlib
+
+# Window(10000) properties the metrics are published in:
+# script.local-resume.metrics.<name> per metric and .metrics with all as JSON
+METRICS_PROPERTY = 'script.local-resume.metrics'
+
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 30000]
+
+class Histogram:
+    """Count, sum, max and fixed buckets of durations, so recording is O(1)
+    and memory doesn't grow with the number of samples."""
+
+    def __init__(self):
+        self.count   = 0
+        self.total   = 0.0
+        self.max     = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def observe(self, ms):
+        self.count += 1
+        self.total += ms
+        self.max    = max(self.max, ms)
+        for i, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile."""
+        if not self.count:
+            return 0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets[:-1]):
+            seen += n
+            if seen >= rank:
+                return BUCKETS_MS[i]
+        return self.max
+
+    def summary(self):
+        avg = self.total / self.count if self.count else 0
+        return {
+            "count": self.count,
+            "avg_ms": round(avg, 2),
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "max_ms": round(self.max, 2),
+        }
+
+class Metrics:
+    """Counters and histograms of the service, shared by its threads."""
+
+    def __init__(self):
+        self.lock       = threading.Lock()
+        self.counters   = {}
+        self.histograms = {}
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def set(self, name, value):
+        with self.lock:
+            self.counters[name] = value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(seconds * 1000)
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        with self.lock:
+            data = dict(self.counters)
+            for name, histogram in self.histograms.items():
+                data[name] = histogram.summary()
+        return data
+
+    def publish(self):
+        """Sets the Window(10000) properties."""
+        data   = self.snapshot()
+        window = xbmcgui.Window(10000)
+        for name, value in data.items():
+            if isinstance(value, dict):
+                value = ' '.join(f"{k}={v}" for k, v in value.items())
+            window.setProperty(f"{METRICS_PROPERTY}.{name}", str(value))
+        window.setProperty(METRICS_PROPERTY, json.dumps(data))
+
+    def log(self, level=xbmc.LOGDEBUG):
+        xbmc.log(f"Local Resume metrics: {json.dumps(self.snapshot(), sort_keys=True)}", level)
+
+# One instance for the whole service
+METRICS = Metrics()
@@ -1,29 +1,74 @@
-import xbmc
 import xbmcgui
 import xbmcaddon
-import json
-import os
+import xbmcplugin
+import xbmcvfs
+import sys
+import urllib.parse
 
-addon = xbmcaddon.Addon()
-addon_path = addon.getAddonInfo('path')
-watched_file = os.path.join(addon_path, 'watched.json')
+from storage import get_history_index, get_shared_cache
 
-def load_watched():
+addon   = xbmcaddon.Addon(id='script.local-resume')
+PROFILE = xbmcvfs.translatePath(addon.getAddonInfo('profile'))
+
+def get_index(limit):
+    # What the service published, or the files when it isn't running
+    # or the listing is longer than the cache
+    cache = get_shared_cache()
+    if cache.refresh() and cache.covers(limit):
+        return cache
+    return get_history_index(PROFILE, addon.getSetting('storage_backend') or 'json')
+
+def build_items(base_url, index, entries):
+    """ListItems for (key, position, updated, total) entries, with playcount and resume point."""
+    items = []
+    for key, position, updated, total in entries:
+        li  = xbmcgui.ListItem(label=key, offscreen=True)
+        tag = li.getVideoInfoTag()
+        tag.setTitle(key)
+        tag.setMediaType('video')
+        tag.setPlaycount(1 if key in index.watched else 0)
+        if position > 0:
+            # Without the total Kodi can't draw the progress overlay
+            tag.setResumePoint(position, total)
+        # The service only stores keys, there is no file to play. Not marked
+        # playable, so a click runs the plugin instead of asking it to resolve.
+        url = f"{base_url}?action=select&key={urllib.parse.quote(key)}"
+        items.append((url, li, False))
+    return items
+
+def list_directory(base_url, handle, params):
+    mode  = params.get('mode', 'inprogress')
     try:
-        with open(watched_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return {}
-
-def apply_watched_status():
-    watched = load_watched()
-    for video_id, entry in watched.items():
-        percent = entry.get("played_percent", 0)
-        if percent >= 90:
-            # For overlays to show up in widgets, the skin must call ListItem.PlayCount
-            # This is a placeholder for whatever sets ListItem.Property in your widget items
-            xbmc.log(f"Marking '{video_id}' as watched (percent: {percent})", xbmc.LOGINFO)
-            # Nothing is returned here—ListItem properties must be injected during item creation
+        limit = int(params.get('limit', 0))
+    except ValueError:
+        limit = 0
+    index = get_index(limit)
+
+    if mode == 'watched':
+        entries = [
+            (key, 0, watched_at, 0)
+            for key, watched_at in sorted(index.watched.items(), key=lambda item: item[1], reverse=True)
+        ]
+    else:
+        entries = index.in_progress
+    if limit:
+        entries = entries[:limit]
+
+    items = build_items(base_url, index, entries)
+    # One call for the whole listing instead of one per item
+    xbmcplugin.addDirectoryItems(handle, items, len(items))
+    xbmcplugin.setContent(handle, 'videos')
+    xbmcplugin.endOfDirectory(handle, cacheToDisc=False)
+
+def main():
+    base_url = sys.argv[0]
+    handle   = int(sys.argv[1])
+    params   = dict(urllib.parse.parse_qsl(sys.argv[2].lstrip('?')))
+
+    if params.get('action') == 'select':
+        # Nothing to do for a clicked entry, see build_items
+        return
+    list_directory(base_url, handle, params)
 
 if __name__ == "__main__":
-    apply_watched_status()
+    main()
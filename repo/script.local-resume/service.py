@@ -4,10 +4,15 @@ import xbmcvfs
 import xbmcgui
 import json
 import os
+import hashlib
+import threading
+import cProfile
 import time
 import urllib.parse
 import re
-import time as pytime  # to avoid confusion with xbmc's time
+
+from metrics import METRICS
+from storage import SharedCache, open_store
 
 # Addon setup
 ADDON = xbmcaddon.Addon(id='script.local-resume')
@@ -15,9 +20,92 @@ LOOP_INTERVAL = float(ADDON.getSetting('loop_interval') or 2)
 PROFILE = xbmcvfs.translatePath(ADDON.getAddonInfo('profile'))
 xbmcvfs.mkdirs(PROFILE)
 
-# Files for storing data
-RESUME_FILE  = os.path.join(PROFILE, 'resume_points.json')
-WATCHED_FILE = os.path.join(PROFILE, 'watched.json')
+def get_storage_backend():
+    # 'json' (resume_points.json + watched.json) or 'sqlite' (local_resume.db)
+    return ADDON.getSetting('storage_backend') or 'json'
+
+def get_key_strategy():
+    # How videos are told apart, see KEY_STRATEGIES
+    return ADDON.getSetting('key_strategy') or 'title'
+
+def get_prompt_settings():
+    # Seconds until the resume dialog closes by itself (0 = never) and what happens then
+    try:
+        timeout = int(ADDON.getSetting('prompt_timeout') or 15)
+    except ValueError:
+        timeout = 15
+    return timeout, (ADDON.getSetting('prompt_default') or 'resume') == 'resume'
+
+# Old history is evicted at start, after settings changes and every 6 hours
+EVICT_INTERVAL = 6 * 3600
+
+def get_eviction_settings():
+    # Caps on the history kept, 0 = no limit
+    try:
+        max_entries  = int(ADDON.getSetting('max_entries') or 0)
+        max_age_days = int(ADDON.getSetting('max_age_days') or 0)
+    except ValueError as e:
+        xbmc.log(f"Error reading eviction settings: {e}", xbmc.LOGERROR)
+        max_entries, max_age_days = 0, 0
+    drop_zero = ADDON.getSetting('drop_zero_entries') == 'true'
+    return max_entries, max_age_days, drop_zero
+
+def start_eviction(store):
+    """Evicts old entries from the store on a background thread."""
+    max_entries, max_age_days, drop_zero = get_eviction_settings()
+    if not (max_entries or max_age_days or drop_zero):
+        return None
+
+    def evict():
+        try:
+            resume, watched = store.evict(max_entries, max_age_days, drop_zero)
+            if resume or watched:
+                xbmc.log(f"Evicted {resume} resume points and {watched} watched entries", xbmc.LOGINFO)
+        except Exception as e:
+            xbmc.log(f"Eviction failed: {e}", xbmc.LOGERROR)
+
+    thread = threading.Thread(target=evict)
+    thread.start()
+    return thread
+
+# Metrics are published to Window(10000) properties this often (seconds)
+METRICS_PUBLISH_INTERVAL = 10
+
+def get_metrics_settings():
+    # How often the metrics summary is logged (0 = never) and at which level
+    try:
+        interval = int(ADDON.getSetting('metrics_log_interval') or 300)
+    except ValueError:
+        interval = 300
+    level = xbmc.LOGINFO if ADDON.getSetting('metrics_log_level') == 'info' else xbmc.LOGDEBUG
+    return interval, level
+
+def get_flush_interval():
+    try:
+        # How long changes may stay in memory before they are written to disk
+        return max(1.0, float(ADDON.getSetting('flush_interval') or 30))
+    except Exception as e:
+        xbmc.log(f"Error reading flush_interval setting: {e}", xbmc.LOGERROR)
+        return 30.0
+
+# Write-behind: changes are kept in memory and written once they are
+# flush_interval old, or right away on pause/stop/abort via flush(force=True)
+class WriteBehindFile:
+    def __init__(self):
+        self.dirty_since = None
+        self.flush_interval = get_flush_interval()
+
+    def mark_dirty(self):
+        if self.dirty_since is None:
+            self.dirty_since = time.time()
+
+    def flush(self, force=False):
+        if self.dirty_since is None:
+            return
+        if force or time.time() - self.dirty_since >= self.flush_interval:
+            self.dirty_since = None
+            with METRICS.timed('save'):
+                self.save()
 
 def get_loop_interval():
     try:
@@ -27,64 +115,65 @@ def get_loop_interval():
         xbmc.log(f"Error reading loop_interval setting: {e}", xbmc.LOGERROR)
         return 2.5
 
-# ResumeManager unchanged…
-class ResumeManager:
-    def __init__(self):
-        self.resume_data = {}
-        self.load_resume_data()
-
-    def load_resume_data(self):
-        if os.path.exists(RESUME_FILE):
-            try:
-                with open(RESUME_FILE, 'r', encoding='utf-8') as f:
-                    self.resume_data = json.load(f)
-            except Exception as e:
-                xbmc.log(f"ResumeManager: Failed to load resume data: {e}", xbmc.LOGERROR)
-                self.resume_data = {}
+# Resume points are written behind to the store (see storage.py), only the
+# keys that changed since the last flush are saved
+class ResumeManager(WriteBehindFile):
+    def __init__(self, store):
+        super().__init__()
+        self.store   = store
+        self.pending = {}
 
     def save_resume_data(self):
+        """Save the changed resume points to the store."""
+        if not self.pending:
+            return
+        records = [(key, pos, ts, total) for key, (pos, total, ts) in self.pending.items()]
         try:
-            with open(RESUME_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.resume_data, f, indent=4)
+            self.store.save_resume_points(records)
+            self.pending.clear()
         except Exception as e:
             xbmc.log(f"ResumeManager: Failed to save resume data: {e}", xbmc.LOGERROR)
 
-    def set_resume_point(self, key, position):
-        self.resume_data[key] = position
-        self.save_resume_data()
+    save = save_resume_data
+
+    def set_resume_point(self, key, position, total=0):
+        # Repeated saves of the same position (e.g. 0 during the first minute) are free
+        if self.get_resume_point(key) == position:
+            return
+        # The total is kept with the position for the plugin's progress overlay
+        self.pending[key] = (position, total, time.time())
+        self.mark_dirty()
 
     def get_resume_point(self, key):
-        return self.resume_data.get(key, 0)
+        if key in self.pending:
+            return self.pending[key][0]
+        return self.store.get_resume_point(key)
 
 # WatchedManager to log completed videos
-class WatchedManager:
-    def __init__(self):
-        self.watched = {}
-        self.load_watched()
-
-    def load_watched(self):
-        if os.path.exists(WATCHED_FILE):
-            try:
-                with open(WATCHED_FILE, 'r', encoding='utf-8') as f:
-                    self.watched = json.load(f)
-            except Exception as e:
-                xbmc.log(f"WatchedManager: Failed to load watched data: {e}", xbmc.LOGERROR)
-                self.watched = {}
+class WatchedManager(WriteBehindFile):
+    def __init__(self, store):
+        super().__init__()
+        self.store   = store
+        self.pending = {}
 
     def save_watched(self):
+        if not self.pending:
+            return
         try:
-            with open(WATCHED_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.watched, f, indent=4)
+            self.store.save_watched(list(self.pending.items()))
+            self.pending.clear()
         except Exception as e:
             xbmc.log(f"WatchedManager: Failed to save watched data: {e}", xbmc.LOGERROR)
 
+    save = save_watched
+
     def mark_watched(self, key):
         """Log when a video was watched to completion."""
-        self.watched[key] = time.time()
-        self.save_watched()
+        self.pending[key] = time.time()
+        self.mark_dirty()
 
     def is_watched(self, key):
-        return key in self.watched
+        return key in self.pending or self.store.is_watched(key)
 
 # Helper to format seconds into h/m/s
 def format_time(seconds):
@@ -99,164 +188,351 @@ def format_time(seconds):
     else:
         return f"{secs}s"
 
-# Friendly key: Title only if no year metadata
-def get_stable_key():
-    tag   = xbmc.Player().getVideoInfoTag()
+# Friendly key: title, or fallback to UI label, or filename
+def key_from_title(player, tag):
     title = tag.getTitle() or ""
-    year  = tag.getYear() or 0
+    if title:
+        return title
+    friendly = xbmc.getInfoLabel("ListItem.Label") or ""
+    if not friendly:
+        path = player.getPlayingFile()
+        friendly = path.split("/")[-1].split("?")[0]
+    return friendly
+
+# Filename without extension, case and separators, so renamed copies still match
+def key_from_filename(player, tag):
+    path = player.getPlayingFile().split("?")[0]
+    name = urllib.parse.unquote(path.replace("\\", "/").split("/")[-1])
+    name = os.path.splitext(name)[0].lower()
+    return re.sub(r"[\s._-]+", " ", name).strip()
+
+# Full path of the file (without query string), for libraries with duplicate titles
+def key_from_path_hash(player, tag):
+    path = player.getPlayingFile().split("?")[0]
+    return hashlib.sha1(path.encode("utf-8")).hexdigest()
+
+KEY_STRATEGIES = {
+    'title':     key_from_title,
+    'filename':  key_from_filename,
+    'path hash': key_from_path_hash,
+}
+
+# Computed once per playback by PlaybackTracker
+def get_stable_key(player, strategy='title'):
+    tag  = player.getVideoInfoTag()
+    year = tag.getYear() or 0
 
     # Skip any with year metadata
     if year:
         return None
+    return KEY_STRATEGIES.get(strategy, key_from_title)(player, tag)
+
+# Saves follow the Player callbacks instead of polling the player: the position
+# is only read when a save is due, on pause and on seek
+class PlaybackTracker(xbmc.Player):
+    def __init__(self, resume_manager, watched_manager):
+        super().__init__()
+        self.resume_manager  = resume_manager
+        self.watched_manager = watched_manager
+        self.loop_interval   = get_loop_interval()
+        self.key_strategy    = get_key_strategy()
+        self.prompt_timeout, self.prompt_resumes = get_prompt_settings()
+        self.prompting       = False
+        self.prompter        = None
+        self.closing         = False
+        self.reset()
+
+    def reset(self):
+        self.key         = None
+        self.file        = None
+        self.prompted    = False
+        self.start_over  = None
+        self.paused      = False
+        self.total       = 0
+        self.next_sample = 0
+
+    def reload_settings(self):
+        self.loop_interval = get_loop_interval()
+        self.key_strategy  = get_key_strategy()
+        self.prompt_timeout, self.prompt_resumes = get_prompt_settings()
+
+    # Player callbacks
+
+    def onAVStarted(self):
+        if not self.isPlayingVideo():
+            return
+        self.close_prompt()
+        self.reset()
+        # The key can't change during a playback, so it's only worked out here
+        self.file  = self.getPlayingFile()
+        self.key   = get_stable_key(self, self.key_strategy)
+        self.total = self.getTotalTime() or 0
+        self.schedule(0)
+
+    def onAVChange(self):
+        # Also sent for stream changes within the same file
+        if self.file is not None and self.isPlayingVideo() and self.getPlayingFile() != self.file:
+            self.onAVStarted()
+
+    def onPlayBackPaused(self):
+        # The resume dialog pauses the player itself
+        if self.key is None or self.prompting:
+            return
+        self.paused = True
+        self.sample()
+        # Paused: the position won't change, write it now
+        self.flush()
+
+    def onPlayBackResumed(self):
+        if self.key is None or self.prompting:
+            return
+        self.paused = False
+        self.schedule(self.getTime())
+
+    def onPlayBackSeek(self, seek_time, seekOffset):
+        if self.key is None:
+            return
+        # Kodi passes the new position, no need to ask for it
+        pos = seek_time / 1000.0
+        self.save_position(pos)
+        self.schedule(pos)
+
+    def onPlayBackEnded(self):
+        if self.key is None:
+            return
+        if self.total > 0:
+            self.save_position(self.total)
+        self.flush()
+        self.reset()
+
+    def onPlayBackStopped(self):
+        # The position can't be read anymore, the last sample stands
+        if self.key is None:
+            return
+        self.close_prompt()
+        self.flush()
+        self.reset()
+
+    # Sampling
+
+    def schedule(self, pos):
+        """Sets when the position is read next."""
+        delay = self.loop_interval
+        # During the first minute the saved position is always 0
+        if pos < 60:
+            delay = max(delay, 60 - pos)
+        self.next_sample = time.time() + delay
+
+    def sample(self):
+        try:
+            pos = self.getTime()
+        except RuntimeError:
+            # Playback ended in the meantime
+            return
+        if not self.total:
+            self.total = self.getTotalTime() or 0
+        METRICS.incr('samples')
+        self.save_position(pos)
+        self.schedule(pos)
+
+    def save_position(self, pos):
+        key = self.key
+        if self.total > 0 and pos >= 0.99 * self.total:
+            # Mark watched at end
+            if not self.watched_manager.is_watched(key):
+                self.watched_manager.mark_watched(key)
+            self.resume_manager.set_resume_point(key, 0, self.total)
+        elif pos <= 60:
+            # First minute: always save 0; after: save pos-4
+            self.resume_manager.set_resume_point(key, 0, self.total)
+        else:
+            self.resume_manager.set_resume_point(key, max(pos - 4, 0), self.total)
+
+    def flush(self):
+        self.resume_manager.flush(force=True)
+        self.watched_manager.flush(force=True)
+
+    def tick(self):
+        """Called from the service loop, prompts for resume and samples when due."""
+        if self.key is None:
+            return
+        if not self.prompted:
+            self.prompted = True
+            self.prompt_resume()
+        # Answered "Don't resume" in the dialog
+        if self.start_over is not None:
+            if self.start_over == self.key:
+                self.resume_manager.set_resume_point(self.key, 0, self.total)
+            self.start_over = None
+        if not self.paused and not self.prompting and time.time() >= self.next_sample:
+            self.sample()
+
+    def wait_time(self):
+        """How long the service loop may sleep before the next tick."""
+        if self.key is None or self.paused:
+            return self.loop_interval
+        return min(self.loop_interval, max(0.5, self.next_sample - time.time()))
+
+    # Resume prompt: shown from a worker thread so the service loop keeps
+    # running, and closed by itself after prompt_timeout seconds
+
+    def prompt_resume(self):
+        stable_key = self.key
+        resume_pos = self.resume_manager.get_resume_point(stable_key)
+        if resume_pos <= 0:
+            return
+
+        # onAVStarted has fired, so the position is valid already
+        if (self.getTime() or 0) >= 60:
+            # Kodi's own resume was used
+            return
+
+        formatted_time = format_time(resume_pos)
+        if self.total > 0:
+            percentage = round((resume_pos / self.total) * 100)
+            resume_label = f"Resume from {formatted_time} ({percentage}% watched)"
+        else:
+            resume_label = f"Resume from {formatted_time}"
 
-    # Use title, or fallback to UI label, or filename
-    if title:
-        friendly = title
-    else:
-        friendly = xbmc.getInfoLabel("ListItem.Label") or ""
-    if not friendly:
-        path = xbmc.Player().getPlayingFile()
-        friendly = path.split("/")[-1].split("?")[0]
-    return friendly
+        self.prompting = True
+        self.prompter  = threading.Thread(
+            target=self.prompt_worker, args=(stable_key, resume_pos, resume_label)
+        )
+        self.prompter.daemon = True
+        self.prompter.start()
+
+    def prompt_worker(self, stable_key, resume_pos, resume_label):
+        try:
+            self.pause()
+            opened  = time.time()
+            default = 0 if self.prompt_resumes else 1
+            choice  = xbmcgui.Dialog().select(
+                "Resume playback?",
+                [resume_label, "Don't resume"],
+                autoclose=self.prompt_timeout * 1000,
+                preselect=default,
+            )
+            METRICS.observe('prompt_wait', time.time() - opened)
+            # Closed because playback stopped, another video started or Kodi is exiting
+            if self.closing or self.key != stable_key:
+                return
+            if choice == -1 and self.prompt_timeout and time.time() - opened >= self.prompt_timeout:
+                choice = default
+            self.pause()
+
+            if choice == 0:
+                xbmc.log(f"Resuming {stable_key} at {resume_pos}s", xbmc.LOGINFO)
+                self.seekTime(resume_pos)
+            else:
+                self.start_over = stable_key
+        except Exception as e:
+            xbmc.log(f"Resume prompt failed: {e}", xbmc.LOGERROR)
+        finally:
+            # A newer prompt may have started already
+            if self.prompter is threading.current_thread():
+                self.prompting = False
+
+    def close_prompt(self):
+        if self.prompting:
+            xbmc.executebuiltin("Dialog.Close(selectdialog,true)")
+
+    def close(self):
+        """Closes an open resume dialog without waiting on the user."""
+        self.closing = True
+        self.close_prompt()
+        if self.prompter is not None:
+            self.prompter.join(2)
+
+# Settings are reloaded when they change instead of on every loop
+class SettingsMonitor(xbmc.Monitor):
+    def __init__(self, on_settings_changed):
+        super().__init__()
+        self.on_settings_changed = on_settings_changed
+
+    def onSettingsChanged(self):
+        self.on_settings_changed()
 
 # Main service loop
 def main():
-    resume_manager  = ResumeManager()
-    watched_manager = WatchedManager()
-    player          = xbmc.Player()
-    monitor         = xbmc.Monitor()
-
-    last_key       = None
-    prompted       = False
-    last_pos       = None
-    pause_saved    = False
-    last_save_time = 0
-    loop_interval  = get_loop_interval()
+    store           = open_store(PROFILE, get_storage_backend())
+    resume_manager  = ResumeManager(store)
+    watched_manager = WatchedManager(store)
+    tracker         = PlaybackTracker(resume_manager, watched_manager)
+    evictor         = None
+    last_eviction   = 0
+    cache           = SharedCache()
+    published       = None
+    metrics_log_interval, metrics_log_level = get_metrics_settings()
+    last_metrics_publish = last_metrics_log = time.time()
+
+    def reload_settings():
+        nonlocal last_eviction, metrics_log_interval, metrics_log_level
+        last_eviction = 0
+        metrics_log_interval, metrics_log_level = get_metrics_settings()
+        tracker.reload_settings()
+        flush_interval = get_flush_interval()
+        resume_manager.flush_interval  = flush_interval
+        watched_manager.flush_interval = flush_interval
+        xbmc.log(f"Settings reloaded, loop interval {tracker.loop_interval}s, flush interval {flush_interval}s", xbmc.LOGINFO)
+
+    monitor = SettingsMonitor(reload_settings)
+
+    # The service was (re)started during playback
+    if tracker.isPlayingVideo():
+        tracker.onAVStarted()
 
     while not monitor.abortRequested():
-        if player.isPlayingVideo():
-            stable_key = get_stable_key()
-            if not stable_key:
-                if monitor.waitForAbort(0.5):
-                    break
-                continue
-
-            # New video? reset state
-            if stable_key != last_key:
-                last_key       = stable_key
-                prompted       = False
-                last_pos       = None
-                pause_saved    = False
-                last_save_time = 0
-            
-            # Prompt resume
-            if not prompted:
-                resume_pos = resume_manager.get_resume_point(stable_key)
-                if resume_pos > 0:
-                    # Wait up to 2 seconds to get a valid current playback time > 0
-                    current_pos = player.getTime() or 0
-                    tries = 0
-                    while current_pos == 0 and tries < 4:
-                        pytime.sleep(0.5)
-                        current_pos = player.getTime() or 0
-                        tries += 1
-
-                    formatted_time = format_time(resume_pos)
-                    total_time = player.getTotalTime() or 0
-
-                    if total_time > 0:
-                        percentage = round((resume_pos / total_time) * 100)
-                        resume_label = f"Resume from {formatted_time} ({percentage}% watched)"
-                    else:
-                        resume_label = f"Resume from {formatted_time}"
-
-                    # Always save resume point as backup
-                    resume_manager.set_resume_point(stable_key, resume_pos)
-
-                    if current_pos < 60:
-                        player.pause()
-                        dialog = xbmcgui.Dialog()
-                        choice = dialog.select(
-                            "Resume playback?",
-                            [resume_label, "Don't resume"]
-                        )
-                        player.pause()
-
-                        if choice == 0:
-                            xbmc.log(f"Resuming {stable_key} at {resume_pos}s", xbmc.LOGINFO)
-                            player.seekTime(resume_pos)
-                        else:
-                            resume_manager.set_resume_point(stable_key, 0)
-                prompted = True
-
-
-            # Track playback
-            pos   = player.getTime()
-            total = player.getTotalTime() or 0
-
-            if last_pos is None:
-                last_pos = pos
-            else:
-                # — Playing → save every loop_interval
-                if pos > last_pos:
-                    now = time.time()
-                    if now - last_save_time >= loop_interval:
-                        if total > 0 and pos >= 0.99 * total:
-                            # Mark watched at end
-                            if not watched_manager.is_watched(stable_key):
-                                watched_manager.mark_watched(stable_key)
-                            resume_manager.set_resume_point(stable_key, 0)
-                        else:
-                            # First minute: always save 0; after: save pos-4
-                            if pos <= 60:
-                                resume_manager.set_resume_point(stable_key, 0)
-                            else:
-                                resume_manager.set_resume_point(stable_key, max(pos - 4, 0))
-                        last_save_time = now
-                    pause_saved = False
-
-                # — Paused → save once on pause
-                elif pos == last_pos and not pause_saved:
-                    now = time.time()
-                    if now - last_save_time >= 0:  # force immediate save on pause
-                        if total > 0 and pos >= 0.99 * total:
-                            if not watched_manager.is_watched(stable_key):
-                                watched_manager.mark_watched(stable_key)
-                            resume_manager.set_resume_point(stable_key, 0)
-                        else:
-                            if pos <= 60:
-                                resume_manager.set_resume_point(stable_key, 0)
-                            else:
-                                resume_manager.set_resume_point(stable_key, max(pos - 4, 0))
-                        last_save_time = now
-                    pause_saved = True
-
-                last_pos = pos
-
-            # Responsive loop when playing (dialog, pos-checks)
-            if monitor.waitForAbort(0.5):
-                break
-
-        else:
-            # Reset when stopped
-            last_key       = None
-            prompted       = False
-            last_pos       = None
-            pause_saved    = False
-            last_save_time = 0
-
-            # Use configurable interval when idle
-            if monitor.waitForAbort(loop_interval):
-                break
+        tick_start = time.perf_counter()
+        tracker.tick()
 
-        # Reload interval if changed
-        new_interval = get_loop_interval()
-        if new_interval != loop_interval:
-            xbmc.log(f"Loop interval changed from {loop_interval} to {new_interval}", xbmc.LOGINFO)
-            loop_interval = new_interval
+        if time.time() - last_eviction >= EVICT_INTERVAL and not (evictor and evictor.is_alive()):
+            evictor       = start_eviction(store)
+            last_eviction = time.time()
 
+        # Write changes that have been pending long enough
+        resume_manager.flush()
+        watched_manager.flush()
 
+        # Share what's on disk now with plugin.py
+        if store.changes != published:
+            published = store.changes
+            try:
+                cache.publish(store)
+            except Exception as e:
+                xbmc.log(f"Failed to publish the shared cache: {e}", xbmc.LOGERROR)
+
+        METRICS.observe('tick', time.perf_counter() - tick_start)
+        now = time.time()
+        if now - last_metrics_publish >= METRICS_PUBLISH_INTERVAL:
+            METRICS.set('bytes_written', store.bytes_written)
+            METRICS.publish()
+            last_metrics_publish = now
+        if metrics_log_interval and now - last_metrics_log >= metrics_log_interval:
+            METRICS.log(metrics_log_level)
+            last_metrics_log = now
+
+        if monitor.waitForAbort(tracker.wait_time()):
+            break
+
+    # Kodi is shutting down (or the service is stopped): nothing may be lost
+    tracker.close()
+    resume_manager.flush(force=True)
+    watched_manager.flush(force=True)
+    if evictor is not None:
+        evictor.join()
+    cache.clear()
+    store.close()
+    METRICS.set('bytes_written', store.bytes_written)
+    METRICS.publish()
+    METRICS.log(metrics_log_level)
 
 
 if __name__ == '__main__':
-    main()
+    if ADDON.getSetting('profile_service') == 'true':
+        # Debug: profile the service thread, open the stats with pstats
+        profiler = cProfile.Profile()
+        profiler.runcall(main)
+        profiler.dump_stats(os.path.join(PROFILE, 'service.prof'))
+        xbmc.log(f"Profile written to {os.path.join(PROFILE, 'service.prof')}", xbmc.LOGINFO)
+    else:
+        main()
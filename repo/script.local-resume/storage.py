@@ -0,0 +1,618 @@
+import xbmc
+import xbmcgui
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+# Files in the addon profile folder
+RESUME_FILE_NAME   = 'resume_points.json'
+WATCHED_FILE_NAME  = 'watched.json'
+DATABASE_FILE_NAME = 'local_resume.db'
+
+# Window(10000) properties the service shares its data with plugin.py in
+CACHE_DATA_PROPERTY       = 'script.local-resume.cache'
+CACHE_GENERATION_PROPERTY = 'script.local-resume.generation'
+# Entries per list in the shared cache
+CACHE_LIMIT = 100
+
+# Once the journal grows past this size it is folded into the snapshot
+JOURNAL_COMPACT_BYTES = 64 * 1024
+
+def write_json_atomic(path, data):
+    """Write data to a temp file and rename it over path, so a crash or power
+    loss leaves either the old or the new file, never a truncated one.
+    Returns the number of bytes written."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp_path, path)
+    return size
+
+class ResumeJournal:
+    """
+    Resume points stored as a JSON snapshot plus an append-only journal.
+
+    Every save appends one small JSON line per changed key to the journal, so
+    its cost doesn't depend on the size of the history. Loading replays the
+    journal over the snapshot. Once the journal passes compact_bytes it is
+    moved aside and a background thread writes a fresh snapshot, after which
+    the old journal is deleted. A line cut short by a power loss is skipped
+    by read() and cut off by load(), so new records don't continue it.
+
+    Snapshot format: {"positions": {key: seconds}, "updated": {key: epoch},
+    "totals": {key: seconds}}. The old flat {key: seconds} resume_points.json
+    is still read.
+    """
+
+    def __init__(self, snapshot_path, compact_bytes=JOURNAL_COMPACT_BYTES):
+        self.snapshot_path  = snapshot_path
+        self.journal_path   = os.path.splitext(snapshot_path)[0] + '.journal'
+        self.compacting_path = self.journal_path + '.compacting'
+        self.compact_bytes  = compact_bytes
+        self.lock           = threading.Lock()
+        self.compactor      = None
+        self.bytes_written  = 0
+
+    def load(self):
+        """Returns (positions, updated, totals) rebuilt from the snapshot and journals."""
+        for path in (self.compacting_path, self.journal_path):
+            self._drop_torn_tail(path)
+        positions, updated, totals = self.read()
+
+        # A compaction was cut short: finish it now, before anything is appended
+        if os.path.exists(self.compacting_path):
+            self.compact(positions, updated, totals, background=False)
+        return positions, updated, totals
+
+    def read(self):
+        """Like load(), but never writes, for readers in other processes."""
+        positions, updated, totals = {}, {}, {}
+        if os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if isinstance(data.get("positions"), dict):
+                    positions = data["positions"]
+                    updated   = data.get("updated", {})
+                    totals    = data.get("totals", {})
+                else:
+                    positions = data
+            except Exception as e:
+                xbmc.log(f"ResumeJournal: Failed to load snapshot: {e}", xbmc.LOGERROR)
+
+        for path in (self.compacting_path, self.journal_path):
+            self._replay(path, positions, updated, totals)
+        return positions, updated, totals
+
+    def _drop_torn_tail(self, path):
+        """Truncates the journal at path after its last complete line."""
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb+') as f:
+            data = f.read()
+            end  = data.rfind(b'\n') + 1
+            if end < len(data):
+                f.truncate(end)
+                f.flush()
+                os.fsync(f.fileno())
+                xbmc.log(f"ResumeJournal: Dropped a torn record at the end of {path}", xbmc.LOGWARNING)
+
+    def _replay(self, path, positions, updated, totals):
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    key = record["k"]
+                except (ValueError, KeyError, TypeError):
+                    # Torn write at the end of the journal
+                    continue
+                if record.get("p") is None:
+                    positions.pop(key, None)
+                    updated.pop(key, None)
+                    totals.pop(key, None)
+                else:
+                    positions[key] = record["p"]
+                    updated[key]   = record.get("t", 0)
+                    totals[key]    = record.get("d", 0)
+
+    def append(self, records):
+        """Appends (key, position, updated, total) records, position None deletes
+        the key. Returns True when the journal is due for compaction."""
+        lines = ''.join(
+            json.dumps({"k": key, "p": position, "t": ts, "d": total}) + '\n'
+            for key, position, ts, total in records
+        )
+        with self.lock:
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+            self.bytes_written += len(lines.encode('utf-8'))
+        return size >= self.compact_bytes
+
+    def compact(self, positions, updated, totals, background=True):
+        """Folds the journal into a new snapshot of the given state."""
+        if self.compactor is not None and self.compactor.is_alive():
+            return
+        with self.lock:
+            # Appends from here on go to a new journal
+            if os.path.exists(self.journal_path):
+                if os.path.exists(self.compacting_path):
+                    # An earlier compaction failed, keep its records too
+                    with open(self.journal_path, 'rb') as src, open(self.compacting_path, 'ab') as dst:
+                        shutil.copyfileobj(src, dst)
+                        dst.flush()
+                        os.fsync(dst.fileno())
+                    os.remove(self.journal_path)
+                else:
+                    os.replace(self.journal_path, self.compacting_path)
+            data = {"positions": dict(positions), "updated": dict(updated), "totals": dict(totals)}
+
+        if background:
+            self.compactor = threading.Thread(target=self._write_snapshot, args=(data,))
+            self.compactor.start()
+        else:
+            self._write_snapshot(data)
+
+    def _write_snapshot(self, data):
+        try:
+            self.bytes_written += write_json_atomic(self.snapshot_path, data)
+            if os.path.exists(self.compacting_path):
+                os.remove(self.compacting_path)
+        except Exception as e:
+            xbmc.log(f"ResumeJournal: Failed to compact: {e}", xbmc.LOGERROR)
+
+    def close(self):
+        """Waits for a running compaction."""
+        if self.compactor is not None:
+            self.compactor.join()
+
+def load_json(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        xbmc.log(f"Failed to load {path}: {e}", xbmc.LOGERROR)
+        return {}
+
+class HistoryIndex:
+    """
+    Read-only view of the service's data for plugin.py. refresh() only reads
+    the files again when their size or mtime changed, so repeated widget
+    refreshes in a reused interpreter cost a few stat() calls.
+    """
+
+    def __init__(self, profile, backend='json'):
+        self.profile     = profile
+        self.backend     = backend
+        self.stamp       = None
+        self.in_progress = []  # (key, position, updated, total), most recent first
+        self.watched     = {}  # key: watched_at
+
+    def paths(self):
+        if self.backend == 'sqlite':
+            db_path = os.path.join(self.profile, DATABASE_FILE_NAME)
+            return [db_path, db_path + '-wal']
+        snapshot_path = os.path.join(self.profile, RESUME_FILE_NAME)
+        journal = ResumeJournal(snapshot_path)
+        return [snapshot_path, journal.journal_path, journal.compacting_path,
+                os.path.join(self.profile, WATCHED_FILE_NAME)]
+
+    def refresh(self):
+        """Reloads the data if it changed on disk, returns True if it did."""
+        stamp = []
+        for path in self.paths():
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamp.append(None)
+        if stamp == self.stamp:
+            return False
+
+        try:
+            if self.backend == 'sqlite':
+                self.load_database()
+            else:
+                self.load_json()
+        except Exception as e:
+            xbmc.log(f"HistoryIndex: Failed to load {self.backend} data: {e}", xbmc.LOGERROR)
+            return False
+        self.stamp = stamp
+        return True
+
+    def load_json(self):
+        positions, updated, totals = ResumeJournal(os.path.join(self.profile, RESUME_FILE_NAME)).read()
+        self.in_progress = sorted(
+            ((key, pos, updated.get(key, 0), totals.get(key, 0)) for key, pos in positions.items() if pos > 0),
+            key=lambda item: item[2],
+            reverse=True,
+        )
+        self.watched = load_json(os.path.join(self.profile, WATCHED_FILE_NAME))
+
+    def load_database(self):
+        db_path = os.path.join(self.profile, DATABASE_FILE_NAME)
+        if not os.path.exists(db_path):
+            self.in_progress, self.watched = [], {}
+            return
+        db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            self.in_progress = db.execute(
+                "SELECT key, position, updated, total FROM resume WHERE position > 0 ORDER BY updated DESC"
+            ).fetchall()
+            self.watched = dict(db.execute("SELECT key, watched_at FROM watched").fetchall())
+        finally:
+            db.close()
+
+# Kept for the lifetime of the interpreter: with reuselanguageinvoker Kodi keeps
+# imported modules loaded between plugin calls (but re-runs plugin.py itself)
+_history_index = None
+
+def get_history_index(profile, backend='json'):
+    """The shared HistoryIndex, refreshed from disk if the data changed."""
+    global _history_index
+    if _history_index is None or (_history_index.profile, _history_index.backend) != (profile, backend):
+        _history_index = HistoryIndex(profile, backend)
+    _history_index.refresh()
+    return _history_index
+
+class SharedCache:
+    """
+    The newest CACHE_LIMIT in-progress and watched entries, published by the
+    service in Window(10000) properties whenever its data changes. plugin.py
+    reads them with the same interface as HistoryIndex, and only parses the
+    data again when the generation property changed, so a listing costs the
+    same however long the history is.
+    """
+
+    def __init__(self):
+        self.window      = xbmcgui.Window(10000)
+        self.generation  = None
+        self.in_progress = []
+        self.watched     = {}
+        self.complete    = False
+
+    def publish(self, store):
+        """Service side: share the store's current data."""
+        in_progress = store.in_progress(CACHE_LIMIT + 1)
+        watched     = store.watched_items(CACHE_LIMIT + 1)
+        complete    = len(in_progress) <= CACHE_LIMIT and len(watched) <= CACHE_LIMIT
+        watched     = dict(watched[:CACHE_LIMIT])
+        in_progress = in_progress[:CACHE_LIMIT]
+        # Older watched entries of videos being played again
+        for key, position, updated, total in in_progress:
+            if key not in watched and store.is_watched(key):
+                watched[key] = 0
+        data = {
+            "in_progress": [list(entry) for entry in in_progress],
+            "watched":     watched,
+            "complete":    complete,
+        }
+        # Unique across service restarts, a reused plugin interpreter may still
+        # hold the previous run's generation
+        generation = str(time.time_ns())
+        self.window.setProperty(CACHE_DATA_PROPERTY, json.dumps(data))
+        self.window.setProperty(CACHE_GENERATION_PROPERTY, generation)
+        self.generation = generation
+
+    def clear(self):
+        """Service side: stop sharing, plugin.py falls back to the files."""
+        self.window.clearProperty(CACHE_GENERATION_PROPERTY)
+        self.window.clearProperty(CACHE_DATA_PROPERTY)
+
+    def refresh(self):
+        """Plugin side: returns True if the cache is usable, parsing it only
+        when the generation changed."""
+        generation = self.window.getProperty(CACHE_GENERATION_PROPERTY)
+        if not generation:
+            return False
+        if generation == self.generation:
+            return True
+        try:
+            data = json.loads(self.window.getProperty(CACHE_DATA_PROPERTY))
+            self.in_progress = [tuple(entry) for entry in data["in_progress"]]
+            self.watched     = data["watched"]
+            self.complete    = data["complete"]
+        except (ValueError, KeyError, TypeError) as e:
+            xbmc.log(f"SharedCache: Failed to read cache: {e}", xbmc.LOGERROR)
+            return False
+        self.generation = generation
+        return True
+
+    def covers(self, limit):
+        """Whether a listing of limit entries can be served from the cache."""
+        return self.complete or 0 < limit <= CACHE_LIMIT
+
+_shared_cache = None
+
+def get_shared_cache():
+    """The SharedCache of this interpreter (see _history_index)."""
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = SharedCache()
+    return _shared_cache
+
+def select_evicted(entries, max_entries=0, max_age_days=0, drop_zero=False):
+    """
+    Picks the entries to evict from (key, value, timestamp) tuples: those with
+    a value of 0 (when drop_zero), those not updated for max_age_days, and
+    beyond that the least recently updated ones over max_entries. Entries
+    without a timestamp (older versions didn't store one) never expire by age.
+    """
+    cutoff = time.time() - max_age_days * 86400 if max_age_days else 0
+    keep, drop = [], []
+    for key, value, ts in entries:
+        if (drop_zero and value <= 0) or (ts and ts < cutoff):
+            drop.append(key)
+        else:
+            keep.append((ts, key))
+    if max_entries and len(keep) > max_entries:
+        keep.sort(reverse=True)
+        drop.extend(key for ts, key in keep[max_entries:])
+    return drop
+
+def open_store(profile, backend='json'):
+    """Returns the store for the storage backend chosen in the settings."""
+    if backend == 'sqlite':
+        try:
+            return SqliteStore(profile)
+        except Exception as e:
+            xbmc.log(f"SqliteStore: Failed to open database, using JSON files: {e}", xbmc.LOGERROR)
+    return JsonStore(profile)
+
+# Both stores offer the same methods. Resume records are (key, position, updated, total)
+# and watched records (key, watched_at); a None position/watched_at deletes the key.
+class JsonStore:
+    """Resume points in a ResumeJournal and watched entries in watched.json,
+    both held in memory as dicts."""
+
+    def __init__(self, profile):
+        self.journal      = ResumeJournal(os.path.join(profile, RESUME_FILE_NAME))
+        self.watched_path = os.path.join(profile, WATCHED_FILE_NAME)
+        self.positions, self.updated, self.totals = self.journal.load()
+        self.watched      = load_json(self.watched_path)
+        # evict() runs on a background thread. Re-entrant, so evict() can
+        # pick and remove entries in one hold of the lock.
+        self.lock         = threading.RLock()
+        # Bumped on every change, so the service knows when to publish
+        self.changes      = 0
+        self.watched_bytes = 0
+
+    def get_resume_point(self, key):
+        return self.positions.get(key, 0)
+
+    def save_resume_points(self, records):
+        with self.lock:
+            for key, position, updated, total in records:
+                if position is None:
+                    self.positions.pop(key, None)
+                    self.updated.pop(key, None)
+                    self.totals.pop(key, None)
+                else:
+                    self.positions[key] = position
+                    self.updated[key]   = updated
+                    self.totals[key]    = total
+            if self.journal.append(records):
+                self.journal.compact(self.positions, self.updated, self.totals)
+            self.changes += 1
+
+    def in_progress(self, limit=None):
+        """Resume points past 0, most recently updated first."""
+        with self.lock:
+            items = [
+                (key, pos, self.updated.get(key, 0), self.totals.get(key, 0))
+                for key, pos in self.positions.items() if pos > 0
+            ]
+        items.sort(key=lambda item: item[2], reverse=True)
+        return items[:limit] if limit else items
+
+    def is_watched(self, key):
+        return key in self.watched
+
+    def save_watched(self, records):
+        with self.lock:
+            for key, watched_at in records:
+                if watched_at is None:
+                    self.watched.pop(key, None)
+                else:
+                    self.watched[key] = watched_at
+            self.watched_bytes += write_json_atomic(self.watched_path, self.watched)
+            self.changes += 1
+
+    def watched_items(self, limit=None):
+        """Watched entries, most recently watched first."""
+        with self.lock:
+            items = sorted(self.watched.items(), key=lambda item: item[1], reverse=True)
+        return items[:limit] if limit else items
+
+    def evict(self, max_entries=0, max_age_days=0, drop_zero=False):
+        """Removes entries as described in select_evicted. Returns the number of
+        resume points and watched entries removed."""
+        # Held from selection to removal, so an entry saved in between can't be evicted
+        with self.lock:
+            resume = select_evicted(
+                ((key, pos, self.updated.get(key, 0)) for key, pos in self.positions.items()),
+                max_entries, max_age_days, drop_zero,
+            )
+            watched = select_evicted(
+                ((key, ts, ts) for key, ts in self.watched.items()),
+                max_entries, max_age_days,
+            )
+            if resume:
+                self.save_resume_points([(key, None, 0, 0) for key in resume])
+                # Shrink the snapshot too, so the next start loads less
+                self.journal.compact(self.positions, self.updated, self.totals)
+            if watched:
+                self.save_watched([(key, None) for key in watched])
+        return len(resume), len(watched)
+
+    @property
+    def bytes_written(self):
+        return self.journal.bytes_written + self.watched_bytes
+
+    def close(self):
+        self.journal.close()
+
+class SqliteStore:
+    """
+    Resume points and watched entries in a SQLite database (WAL mode), so
+    nothing is loaded up front and lookups stay flat however large the
+    history gets. Entries already in the JSON files are imported the first
+    time the database is opened; the JSON files are left in place.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS resume (
+            key      TEXT PRIMARY KEY,
+            position REAL NOT NULL,
+            updated  REAL NOT NULL,
+            total    REAL NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS resume_updated ON resume (updated);
+        CREATE TABLE IF NOT EXISTS watched (
+            key        TEXT PRIMARY KEY,
+            watched_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS watched_watched_at ON watched (watched_at);
+        CREATE TABLE IF NOT EXISTS meta (
+            name  TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.lock    = threading.Lock()
+        self.changes = 0
+        # Size of the rows saved, SQLite's own page writes can't be seen from here
+        self.bytes_written = 0
+        self.db      = sqlite3.connect(
+            os.path.join(profile, DATABASE_FILE_NAME), check_same_thread=False
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(self.SCHEMA)
+        self.upgrade()
+        self.migrate()
+
+    def upgrade(self):
+        """Adds the columns newer versions store to a database made by an older one."""
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(resume)")]
+        if "total" not in columns:
+            with self.db:
+                self.db.execute("ALTER TABLE resume ADD COLUMN total REAL NOT NULL DEFAULT 0")
+
+    def migrate(self):
+        """Imports resume_points.json (and its journal) and watched.json once."""
+        if self.db.execute("SELECT 1 FROM meta WHERE name = 'migrated'").fetchone():
+            return
+        positions, updated, totals = ResumeJournal(os.path.join(self.profile, RESUME_FILE_NAME)).load()
+        watched = load_json(os.path.join(self.profile, WATCHED_FILE_NAME))
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO resume (key, position, updated, total) VALUES (?, ?, ?, ?)",
+                [(key, pos, updated.get(key, 0), totals.get(key, 0)) for key, pos in positions.items()],
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO watched (key, watched_at) VALUES (?, ?)",
+                watched.items(),
+            )
+            self.db.execute("INSERT INTO meta (name, value) VALUES ('migrated', '1')")
+        if positions or watched:
+            xbmc.log(f"SqliteStore: Imported {len(positions)} resume points and {len(watched)} watched entries", xbmc.LOGINFO)
+
+    def get_resume_point(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT position FROM resume WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def save_resume_points(self, records):
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO resume (key, position, updated, total) VALUES (?, ?, ?, ?)",
+                [r for r in records if r[1] is not None],
+            )
+            self.db.executemany(
+                "DELETE FROM resume WHERE key = ?",
+                [(r[0],) for r in records if r[1] is None],
+            )
+            self.changes += 1
+            self.bytes_written += sum(len(r[0].encode('utf-8')) + 24 for r in records)
+
+    def in_progress(self, limit=None):
+        """Resume points past 0, most recently updated first."""
+        with self.lock:
+            return self.db.execute(
+                "SELECT key, position, updated, total FROM resume WHERE position > 0 "
+                "ORDER BY updated DESC LIMIT ?",
+                (limit or -1,),
+            ).fetchall()
+
+    def is_watched(self, key):
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM watched WHERE key = ?", (key,)).fetchone() is not None
+
+    def save_watched(self, records):
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO watched (key, watched_at) VALUES (?, ?)",
+                [r for r in records if r[1] is not None],
+            )
+            self.db.executemany(
+                "DELETE FROM watched WHERE key = ?",
+                [(r[0],) for r in records if r[1] is None],
+            )
+            self.changes += 1
+            self.bytes_written += sum(len(r[0].encode('utf-8')) + 8 for r in records)
+
+    def watched_items(self, limit=None):
+        """Watched entries, most recently watched first."""
+        with self.lock:
+            return self.db.execute(
+                "SELECT key, watched_at FROM watched ORDER BY watched_at DESC LIMIT ?",
+                (limit or -1,),
+            ).fetchall()
+
+    def evict(self, max_entries=0, max_age_days=0, drop_zero=False):
+        """Removes entries as described in select_evicted. Returns the number of
+        resume points and watched entries removed."""
+        cutoff = time.time() - max_age_days * 86400 if max_age_days else 0
+        with self.lock, self.db:
+            resume = 0
+            if drop_zero:
+                resume += self.db.execute("DELETE FROM resume WHERE position <= 0").rowcount
+            resume += self.db.execute(
+                "DELETE FROM resume WHERE updated > 0 AND updated < ?", (cutoff,)
+            ).rowcount
+            watched = self.db.execute(
+                "DELETE FROM watched WHERE watched_at > 0 AND watched_at < ?", (cutoff,)
+            ).rowcount
+            if max_entries:
+                resume += self.db.execute(
+                    "DELETE FROM resume WHERE key NOT IN "
+                    "(SELECT key FROM resume ORDER BY updated DESC LIMIT ?)",
+                    (max_entries,),
+                ).rowcount
+                watched += self.db.execute(
+                    "DELETE FROM watched WHERE key NOT IN "
+                    "(SELECT key FROM watched ORDER BY watched_at DESC LIMIT ?)",
+                    (max_entries,),
+                ).rowcount
+            if resume or watched:
+                self.changes += 1
+        return resume, watched
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -1,153 +1,124 @@
-import re, sys
+import sys
 import xbmc, xbmcvfs, xbmcgui
 
-def change_theme():    
+from skin_xml import SkinXml
+from theme_bundles import apply_bundle, get_theme_bundles
 
+def patch_home_bingie(skin, logo_path, diffuse_hex):
+    """
+    Points the Bingie logo images of the HomeBingie include to logo_path
+    and colours the line next to the hub name. Returns False if the
+    include or the logo images are missing.
+    """
+    home = skin.include("HomeBingie")
+    if home is None:
+        return False
+    logos = [
+        control for control in home.find_all("control", type="image")
+        if control.child_text("description") == "Bingie logo" and control.child("texture") is not None
+    ]
+    if not logos:
+        return False
+    for control in logos:
+        skin.set_text(control.child("texture"), logo_path)
+    # The line image (bingie/line.png) keeps its colour in a colordiffuse attribute
+    for texture in home.find_all("texture"):
+        if texture.text == "bingie/line.png" and texture.get("colordiffuse"):
+            skin.set_attr(texture, "colordiffuse", "ff" + diffuse_hex)
+    return True
+
+def patch_mpaa_top_bar(skin, diffuse_hex):
+    """
+    Sets the colordiffuse of the top bar's accent image (diffuse/panel2.png),
+    e.g. <colordiffuse>FFE50914</colordiffuse>. Returns False if it is missing.
+    """
+    found = False
+    for control in skin.root.find_all("control", type="image"):
+        if control.child_text("texture") == "diffuse/panel2.png" and control.child("colordiffuse") is not None:
+            skin.set_text(control.child("colordiffuse"), "FF" + diffuse_hex.upper())
+            found = True
+    return found
+
+def patch_skin_files(logo_path, diffuse_hex):
+    """
+    For skins without the theme variables: writes the logo and colour into
+    the skin XML files, which then needs a ReloadSkin. Returns False after
+    showing an error if a target is missing, before any file is written.
+    """
     dialog = xbmcgui.Dialog()
 
-    # Define your available theme options as tuples: (Display Label, Logo Image Path, Diffuse Hex Code)
-    logo_options = [
-        ("Red (Default)",                   "home/bingie_logo.png",                     "e50914"),
-        ("Yellow",                          "home/bingie_logo_yellow.png",              "e5c709"),
-        ("Yellow (Smiler)",                 "home/bingie_logo_yellow2.png",             "ffec00"),
-        ("Blue (Prime Video)",              "home/bingie_logo_blue.png",                "0679fd"),
-        ("Pink (iPlayer)",                  "home/bingie_logo_pink.png",                "ff4c98"),
-        ("Turquoise",                       "home/bingie_logo_turquoise.png",           "45b8ac"),
-        ("Sunlight",                        "home/bingie_logo_sunlight.png",            "edd59e"),
-        ("Orange",                          "home/bingie_logo_orange.png",              "ffa00a"),
-        ("Orange (Rec Room)",               "home/bingie_logo_orange2.png",             "ff6727"),
-        ("Green",                           "home/bingie_logo_green.png",               "1dd72f"),
-        ("Light Green (Channel 4)",         "home/bingie_logo_light_green.png",         "aaff89"),
-        ("Aqua (Kodi)",                     "home/bingie_logo_aqua.png",                "2ba7d7"),
-        ("Aqua 2",                          "home/bingie_logo_aqua2.png",               "01ffff"),
-        ("Peach Fuzz",                      "home/bingie_logo_peach_fuzz.png",          "ffbe98"),
-        ("Purple",                          "home/bingie_logo_purple.png",              "a515ff"),
-        ("Purple (GOG)",                    "home/bingie_logo_purple2.png",             "6900d1"),
-        ("Dedflix",                         "home/bingie_logo_dedflix.png",             "c20c0c"),
-        ("Dedflix (Orange)",                "home/bingie_logo_dedflix2.png",            "fb7e07"),
-        ("Nedflix",                         "home/bingie_logo_nedflix.png",             "1ed760")
-    ]
-    
-    # Build a list of display labels for the selection dialog.
-    display_labels = [option[0] for option in logo_options]
-    
     # Translate the file path for the IncludesHomeBingie.xml file.
     file_path = xbmcvfs.translatePath("special://home/addons/skin.nedflix/1080i/IncludesHomeBingie.xml")
     if not xbmcvfs.exists(file_path):
         dialog.ok("Error", "File not found:\n" + file_path)
-        return
-    
-    # Translate the file path for the Theme Variable.theme file.
-    theme_file_path = xbmcvfs.translatePath("special://home/addons/skin.nedflix/extras/skinthemes/Update Theme.theme")
-    
+        return False
+
     # Translate the file path for the Custom_1159_MPAATopBar.xml file.
     custom_file_path = xbmcvfs.translatePath("special://home/addons/skin.nedflix/1080i/Custom_1159_MPAATopBar.xml")
-    
-    # Define the list of theme data keys that should get updated in the theme file.
-    # Add or remove keys as needed.
-    keys_to_update = [
-        "WatchedIndicator.Watched.Color.base",
-        "BingieProgressBarColor.base",
-        "WatchedIndicator.Episodes.Color",
-        "SpinnerTextureColor.base"
-        "LineUnderMenuIconsColor.base",
-        "lineundermenuiconscolor",
-        "BingieOSDProgressBarColor.base",
-        "BingieProgressBarColor",
-        "WatchedIndicator.Episodes.Color.base",
-        "WatchedIndicator.Watched.Color",
-        "OSDVolumeButtonColor.base",
-        "BingieNewEpisodesTagColor.base",
-        "WatchedIndicator.Progress.Color.base",
-        "bingienewepisodestagcolor",
-        "ActiveSpinControlColor",
-        "SpinnerTextureColor",
-        "WatchedIndicator.Progress.Color",
-        "ActiveSpinControlColor.base",
-        "OSDBufferingSpinnerColor.base",
-        "bingieosdprogressbarcolor",
-        "OSDVolumeButtonColor",
-        "osdbufferingspinnercolor",
-        
-        # You can add additional keys here if needed.
-    ]
-    
+
+    # -----------------------------------
+    # Update IncludesHomeBingie.xml
+    # -----------------------------------
+    home_bingie = SkinXml(file_path)
+    if not patch_home_bingie(home_bingie, logo_path, diffuse_hex):
+        dialog.ok("Error", "Could not find the Bingie logo in IncludesHomeBingie.xml.")
+        return False
+
+    # -----------------------------------
+    # Update Custom_1159_MPAATopBar.xml
+    # -----------------------------------
+    top_bar = None
+    if xbmcvfs.exists(custom_file_path):
+        top_bar = SkinXml(custom_file_path)
+        if not patch_mpaa_top_bar(top_bar, diffuse_hex):
+            dialog.ok("Error", "Could not find the top bar colour in Custom_1159_MPAATopBar.xml.")
+            return False
+
+    # Only written once every target was found, each file once with all of its edits.
+    home_bingie.save()
+    if top_bar is not None:
+        top_bar.save()
+    return True
+
+def change_theme():
+    """
+    Theme selection. Themes are pre-compiled into bundles (see theme_bundles),
+    so applying one only sets skin strings and swaps in the theme file; the
+    skin shows the new logo and colours without a reload. Skins from before
+    the theme variables still get their XML files patched and reloaded.
+    """
+    dialog = xbmcgui.Dialog()
+
+    try:
+        bundles = get_theme_bundles()
+    except Exception as e:
+        xbmc.log("Error compiling Bingie themes: " + str(e), xbmc.LOGERROR)
+        dialog.ok("Error", "Failed to prepare Bingie themes.")
+        return
+
+    # Build a list of display labels for the selection dialog.
+    display_labels = [bundle["label"] for bundle in bundles["bundles"]]
+
     # Loop continuously so the theme-selection dialog remains available until cancelled.
     while True:
         choice = dialog.select("Choose Theme", display_labels)
         if choice == -1:
             break  # Exit the function if the user cancels.
-            
-        # Map the selection to the chosen values.
-        new_logo_path = logo_options[choice][1]
-        new_diffuse_hex = logo_options[choice][2]
-        
+
+        bundle = bundles["bundles"][choice]
+
         try:
-            # -----------------------------------
-            # Update IncludesHomeBingie.xml
-            # -----------------------------------
-            with open(file_path, "r", encoding="utf-8") as f:
-                lines = f.readlines()
-            
-            if len(lines) < 835:
-                dialog.ok("Error", "The file does not have at least 835 lines.")
-                continue
-            
-            # Update the Bingie Logo line (assumed line 820; index 819)
-            lines[819] = re.sub(r'(<texture>).*?(</texture>)', r'\1' + new_logo_path + r'\2', lines[819])
-            # Update the Bingie Logo line (assumed line 832; index 831)
-            lines[831] = re.sub(r'(<texture>).*?(</texture>)', r'\1' + new_logo_path + r'\2', lines[831])
-            # Update the diffuse color line (assumed line 847; index 846)
-            lines[846] = re.sub(r'(colordiffuse=")[0-9A-Fa-f]{8}(")', r'\1' + "ff" + new_diffuse_hex + r'\2', lines[846])
-            
-            # Write the updated contents back to IncludesHomeBingie.xml.
-            with open(file_path, "w", encoding="utf-8") as f:
-                f.writelines(lines)
-            
-            # -----------------------------------
-            # Update Custom_1159_MPAATopBar.xml (line 36)
-            # -----------------------------------
-            if xbmcvfs.exists(custom_file_path):
-                with open(custom_file_path, "r", encoding="utf-8") as f:
-                    custom_lines = f.readlines()
-                
-                if len(custom_lines) < 36:
-                    dialog.ok("Error", "Custom_1159_MPAATopBar.xml does not have at least 36 lines.")
-                else:
-                    # Using index 35 (line 36) modify the colordiffuse tag.
-                    # The expected tag is: <colordiffuse>FFE50914</colordiffuse>
-                    # We update the inner value to "FF" + new_diffuse_hex (in uppercase).
-                    custom_lines[35] = re.sub(r"(<colordiffuse>)[^<]*(</colordiffuse>)",
-                                              r"\1" + "FF" + new_diffuse_hex.upper() + r"\2",
-                                              custom_lines[35])
-                    
-                    # Write back the updated lines.
-                    with open(custom_file_path, "w", encoding="utf-8") as f:
-                        f.writelines(custom_lines)
-            
-            # -----------------------------------
-            # Update the Theme Variable.theme file if it exists.
-            # -----------------------------------
-            if xbmcvfs.exists(theme_file_path):
-                with open(theme_file_path, "r", encoding="utf-8") as f:
-                    theme_content = f.read()
-                
-                # For each key, update its value within the tuple.
-                for key in keys_to_update:
-                    # Construct a regex from the key.
-                    # Pattern matches tuple of the form: ('string', 'KEY', 'XXXXXXXX')
-                    pattern = r"(\('string',\s*'" + re.escape(key) + r"'\s*,\s*')[0-9A-Fa-f]{8}('.*\))"
-                    replacement = r"\1" + "ff" + new_diffuse_hex + r"\2"
-                    theme_content = re.sub(pattern, replacement, theme_content)
-                
-                with open(theme_file_path, "w", encoding="utf-8") as f:
-                    f.write(theme_content)
-            
-            # Refresh the skin automatically.
-            xbmc.executebuiltin("ReloadSkin()")
-            xbmc.executebuiltin("RunScript(script.skin.helper.skinbackup,action=colorthemes)")
-            sys.exit()
-        
+            if not bundles["skin_variables"]:
+                if not patch_skin_files(bundle["logo"], bundle["hex"]):
+                    continue
+
+            apply_bundle(bundle)
+
+            if not bundles["skin_variables"]:
+                # Refresh the skin to load the patched XML files.
+                xbmc.executebuiltin("ReloadSkin()")
+                sys.exit()
+
         except Exception as e:
             xbmc.log("Error updating Bingie theme: " + str(e), xbmc.LOGERROR)
-            dialog.ok("Error", "Failed to update Bingie theme.")
\ No newline at end of file
+            dialog.ok("Error", "Failed to update Bingie theme.")
@@ -1,18 +1,18 @@
 import os
-import re
 import time
 import sys
 import xbmc
 import xbmcaddon
 import xbmcgui
 import xbmcvfs
-import json
 
 import home_widgets_ordering
 import rename_delete_widgets
 from change_widget_size import change_widget_size
 from change_splash import choose_splash_screen
 from change_theme import change_theme 
+from skin_settings import get_skin_settings
+from edit_session import EditSession, confirm_changes
 
 # Friendly mappings for hubs (used for display)
 HUB_FRIENDLY_MAPPING = {
@@ -33,11 +33,7 @@ def extract_hub_names(xml_file):
     Returns both the raw hub IDs and a friendly display list.
     """
     try:
-        with open(xml_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        pattern = re.compile(r'<setting id="(bingiehub-[^-]+)-\d+\.label" type="string">')
-        hubs = pattern.findall(content)
-        hubs = sorted(list(set(hubs)))
+        hubs = get_skin_settings(xml_file).hubs()
         hubs = [hub for hub in hubs if not hub.endswith("local") and hub not in ["bingiehub-customhub", "bingiehub-somethingaddon"]]
         display_list = []
         for hub in hubs:
@@ -54,173 +50,32 @@ def extract_widget_names(xml_file, hub):
     Assumes a maximum of 10 widget slots.
     """
     try:
-        with open(xml_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        widget_names = []
-        for i in range(10):
-            widget_id = 510 + i * 10 if i < 9 else 5100
-            label_pattern = rf'<setting id="{hub}-{widget_id}\.label" type="string">(.*?)</setting>'
-            match = re.search(label_pattern, content)
-            if match and match.group(1).strip():
-                widget_names.append(match.group(1).strip())
-            else:
-                widget_names.append(f"Slot {i+1} (No widget assigned)")
-        return widget_names
+        return get_skin_settings(xml_file).widget_names(hub)
     except Exception:
         return []
 
-def clear_hub_properties_json(properties_file, slot_index):
-    """
-    Clears all property values for a home widget slot in the properties JSON file.
-    Deletes the text within the fourth element of each relevant entry.
-    """
-    try:
-        with open(properties_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        suffix = "" if slot_index == 1 else f".{slot_index - 1}"
-        keys_to_clear = ["widget", "widgetName", "widgetType", "widgetTarget", "widgetPath"]
-
-        for entry in data:
-            if isinstance(entry, list) and len(entry) == 4:  # Ensure the entry is correctly formatted
-                if entry[0] == "mainmenu" and entry[1] == "10000":  # Target home widgets
-                    for key in keys_to_clear:
-                        if entry[2] == f"{key}{suffix}":  
-                            entry[3] = ""  # Clear only the fourth value in the list
-
-        # Save the updated JSON file
-        with open(properties_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4)
-
-    except Exception as e:
-        xbmc.log("Error clearing home widget properties: " + str(e), xbmc.LOGERROR)
-        xbmcgui.Dialog().ok("Error", "Failed to clear home widget properties.")
-
-def update_hub_properties_json(properties_file, slot_index, new_value, is_home_widget=False):
-    """
-    Updates the widgetName in the properties JSON file.
-    Ensures that home widget updates do not affect hub widgets by scoping updates.
-    """
-    try:
-        with open(properties_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        suffix = "" if slot_index == 1 else f".{slot_index - 1}"
-        target_key = "widgetName" + suffix
-        updated = False
-
-        for entry in data:
-            if isinstance(entry, list) and len(entry) >= 4:
-                if entry[0] == "mainmenu" and entry[1] == "10000":
-                    if is_home_widget:
-                        # Restrict updates ONLY to home widgets (should not affect hubs)
-                        if not entry[2].startswith("hub-"):
-                            if entry[2] == target_key:
-                                entry[3] = new_value
-                                updated = True
-                    else:
-                        # Restrict updates ONLY to hub widgets
-                        if entry[2].startswith("hub-"):
-                            if entry[2] == target_key:
-                                entry[3] = new_value
-                                updated = True
-
-        if not updated:
-            xbmcgui.Dialog().ok("Warning", "No matching JSON widgetName entry was found.")
-
-        with open(properties_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4)
-    except Exception as e:
-        xbmc.log("Error updating hub JSON properties: " + str(e), xbmc.LOGERROR)
-        xbmcgui.Dialog().ok("Error", "Failed to update hub JSON properties.")
-    """
-    Directly updates the widgetName value for a hub widget slot in the JSON properties file.
-    For slot 1, the key is "widgetName"; for slot i (i>=2) it is "widgetName.{i-1}".
-    """
-    try:
-        with open(properties_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        suffix = "" if slot_index == 1 else f".{slot_index - 1}"
-        target_key = "widgetName" + suffix
-        updated = False
-        for entry in data:
-            if isinstance(entry, list) and len(entry) >= 4:
-                if entry[0] == "mainmenu" and entry[1] == "10000" and entry[2] == target_key:
-                    entry[3] = new_value
-                    updated = True
-        if not updated:
-            xbmcgui.Dialog().ok("Warning", "No matching JSON widgetName entry was found.")
-        with open(properties_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4)
-    except Exception as e:
-        xbmc.log("Error updating hub JSON properties: " + str(e), xbmc.LOGERROR)
-        xbmcgui.Dialog().ok("Error", "Failed to update hub JSON properties.")
-
-def remove_widget_includes(skin_xml_file, widget_id):
-    """
-    Removes <include> blocks from the skin XML file that contain a 
-    <param name="widgetid" value="widget_id" /> element.
-    """
-    try:
-        with open(skin_xml_file, "r", encoding="utf-8") as f:
-            xml_content = f.read()
-        pattern = rf"<include\b(?:(?!<\/include>).)*?<param\s+name=\"widgetid\"\s+value=\"{re.escape(widget_id)}\".*?<\/include>"
-        new_xml, count = re.subn(pattern, "", xml_content, flags=re.DOTALL | re.IGNORECASE)
-        if count == 0:
-            xbmcgui.Dialog().ok("Warning", f"No matching include blocks found for widgetid {widget_id}.")
-        with open(skin_xml_file, "w", encoding="utf-8") as f:
-            f.write(new_xml)
-    except Exception as e:
-        xbmc.log("Error removing widget includes: " + str(e), xbmc.LOGERROR)
-        xbmcgui.Dialog().ok("Error", "Failed to remove widget includes.")
-
 def reorder_hub_widgets(selected_hub, settings_file):
     """
-    Reorders widgets for a given hub by swapping widget settings in the XML file.
-    """
-    while True:
-        widgets = extract_widget_names(settings_file, selected_hub)
-        if not widgets:
-            xbmcgui.Dialog().ok("Error", "No widgets found for the selected hub.")
-            return
-        dlg = xbmcgui.Dialog()
-        while True:
-            src = dlg.select("Select widget to move", widgets)
-            if src == -1:
-                return
-            tgt = dlg.select("Select target slot", widgets, preselect=src)
-            if tgt == -1 or src == tgt:
-                break
-            reorder_widget(settings_file, selected_hub, src, tgt)
-            # Refresh the widget order after swap.
-            widgets = extract_widget_names(settings_file, selected_hub)
-
-def reorder_widget(xml_file, hub, source_index, target_index):
-    """
-    Swaps the settings for two widget slots within the specified hub.
+    Reorders widgets for a given hub. The moves are staged in an edit session
+    and written together once the user leaves the list and confirms.
     """
     try:
-        with open(xml_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        widget_id_source = 510 + source_index * 10 if source_index < 9 else 5100
-        widget_id_target = 510 + target_index * 10 if target_index < 9 else 5100
-        keys = ["path", "label", "sortorder", "sortby", "LocalizedSortOrder", "LocalizedSortBy", "target"]
-        for key in keys:
-            pattern_src = re.compile(rf'(<setting id="{hub}-{widget_id_source}\.{key}" type="string">)(.*?)(</setting>)')
-            pattern_tgt = re.compile(rf'(<setting id="{hub}-{widget_id_target}\.{key}" type="string">)(.*?)(</setting>)')
-            src_match = pattern_src.search(content)
-            tgt_match = pattern_tgt.search(content)
-            if src_match and tgt_match:
-                src_val = src_match.group(2)
-                tgt_val = tgt_match.group(2)
-                content = content.replace(src_match.group(0),
-                                          f'{src_match.group(1)}{tgt_val}{src_match.group(3)}')
-                content = content.replace(tgt_match.group(0),
-                                          f'{tgt_match.group(1)}{src_val}{tgt_match.group(3)}')
-        with open(xml_file, 'w', encoding='utf-8') as f:
-            f.write(content)
+        session = EditSession(settings_file)
     except Exception as e:
-        xbmc.log(f"[Reorder Hub Widgets] Failed to swap widget values: {e}", xbmc.LOGERROR)
+        xbmc.log(f"[Reorder Hub Widgets] Failed to load settings: {e}", xbmc.LOGERROR)
+        xbmcgui.Dialog().ok("Error", "No widgets found for the selected hub.")
+        return
+    dlg = xbmcgui.Dialog()
+    while True:
+        widgets = session.settings.widget_names(selected_hub)
+        src = dlg.select("Select widget to move", widgets)
+        if src == -1:
+            break
+        tgt = dlg.select("Select target slot", widgets, preselect=src)
+        if tgt == -1 or src == tgt:
+            continue
+        session.move_hub_widget(selected_hub, src, tgt)
+    confirm_changes(session, "Save widget order?")
 
 def reorder_widgets_menu(settings_file):
     """
@@ -0,0 +1,209 @@
+import os
+import re
+import json
+import xbmc
+import xbmcaddon
+import xbmcgui
+import xbmcvfs
+
+from file_utils import write_file
+from skin_properties import SkinProperties, slot_key
+from skin_settings import get_skin_settings, widget_id
+
+PROPERTIES_FILE = xbmcvfs.translatePath("special://userdata/addon_data/script.skinshortcuts/skin.nedflix.properties")
+SKIN_XML_FILE   = xbmcvfs.translatePath("special://userdata/addon_data/script.skinshortcuts/skin.xml")
+
+# Lists the temp files of a commit that are still to be renamed into place
+COMMIT_FILE = os.path.join(
+    xbmcvfs.translatePath(xbmcaddon.Addon(id='script.nedflix.manager').getAddonInfo('profile')),
+    "pending_commit.json"
+)
+
+def recover_commit():
+    """
+    Finishes a commit that was cut short. All temp files are written before
+    the commit file, so once it exists the commit only has to be rolled forward.
+    """
+    if not os.path.exists(COMMIT_FILE):
+        return
+    try:
+        with open(COMMIT_FILE, "r", encoding="utf-8") as f:
+            renames = json.load(f)
+        for tmp_path, path in renames:
+            if os.path.exists(tmp_path):
+                os.replace(tmp_path, path)
+        os.remove(COMMIT_FILE)
+        xbmc.log("[Edit Session] Finished an interrupted commit", xbmc.LOGINFO)
+    except Exception as e:
+        xbmc.log(f"[Edit Session] Failed to finish an interrupted commit: {e}", xbmc.LOGERROR)
+
+class EditSession:
+    """
+    Stages widget moves, renames and deletes across the skin's settings.xml,
+    skin.nedflix.properties and the skinshortcuts skin.xml includes. Edits
+    only change the in-memory copies; commit() writes every changed file in
+    one go, abort() throws the edits away.
+    """
+
+    def __init__(self, settings_file=None, properties_file=PROPERTIES_FILE, includes_file=SKIN_XML_FILE):
+        recover_commit()
+        self.settings_file   = settings_file
+        self.properties_file = properties_file
+        self.includes_file   = includes_file
+        # Home widget edits don't need settings.xml
+        self.settings        = get_skin_settings(settings_file) if settings_file else None
+        self.properties      = None  # loaded on first use
+        self.includes        = None
+        self.properties_dirty = False
+        self.includes_dirty  = False
+        self.changes         = []  # descriptions for the preview
+
+    # Loading
+
+    def get_properties(self):
+        if self.properties is None:
+            self.properties = SkinProperties.load(self.properties_file)
+        return self.properties
+
+    def get_includes(self):
+        if self.includes is None:
+            with open(self.includes_file, "r", encoding="utf-8") as f:
+                self.includes = f.read()
+        return self.includes
+
+    # Hub widgets (settings.xml)
+
+    def move_hub_widget(self, hub, source_index, target_index):
+        names = self.settings.widget_names(hub)
+        self.settings.swap(hub, widget_id(source_index), widget_id(target_index))
+        self.changes.append(f"Swap '{names[source_index]}' and '{names[target_index]}'")
+
+    def rename_hub_widget(self, hub, index, new_name):
+        """Returns False if the slot has no label setting."""
+        old_name = self.settings.get(hub, widget_id(index), "label")
+        if not self.settings.set(hub, widget_id(index), "label", new_name):
+            return False
+        self.set_widget_name(index + 1, new_name, is_home_widget=False)
+        self.changes.append(f"Rename '{old_name}' to '{new_name}'")
+        return True
+
+    def delete_hub_widget(self, hub, index, include_widget_id):
+        """Returns False if the slot has no settings."""
+        name = self.settings.get(hub, widget_id(index), "label")
+        # Load the other files first, so a failed load leaves the settings untouched
+        self.get_properties()
+        if os.path.exists(self.includes_file):
+            self.get_includes()
+        if self.settings.delete(hub, widget_id(index)) == 0:
+            return False
+        self.set_widget_name(index + 1, "", is_home_widget=False)
+        self.remove_widget_includes(include_widget_id)
+        self.changes.append(f"Delete '{name}'")
+        return True
+
+    # Home widgets (skin.nedflix.properties), slot_index is 1-based
+
+    def move_home_widget(self, source_slot, target_slot, source_name="", target_name=""):
+        """Swaps the values of two home widget slots."""
+        self.get_properties().swap_slots("mainmenu", "10000", source_slot - 1, target_slot - 1)
+        self.properties_dirty = True
+        self.changes.append(f"Swap '{source_name or f'Slot {source_slot}'}' and '{target_name or f'Slot {target_slot}'}'")
+
+    def rename_home_widget(self, slot_index, old_name, new_name):
+        self.set_widget_name(slot_index, new_name, is_home_widget=True)
+        self.changes.append(f"Rename '{old_name}' to '{new_name}'")
+
+    def delete_home_widget(self, slot_index, name):
+        """Clears every value of the home widget slot."""
+        self.get_properties().clear_slot("mainmenu", "10000", slot_index - 1)
+        self.properties_dirty = True
+        self.changes.append(f"Delete '{name}'")
+
+    def set_widget_name(self, slot_index, new_value, is_home_widget=False):
+        """
+        Sets widgetName of a slot. Hub widgets use "hub.widgetName" keys, an
+        entry is added if there is none; home widgets only update an existing one.
+        """
+        properties = self.get_properties()
+        target_key = slot_key("widgetName" if is_home_widget else "hub.widgetName", slot_index - 1)
+        if is_home_widget and not properties.has("mainmenu", "10000", target_key):
+            xbmc.log(f"[Edit Session] No properties entry found for key: {target_key}", xbmc.LOGWARNING)
+            return
+        properties.set("mainmenu", "10000", target_key, new_value)
+        self.properties_dirty = True
+
+    # Includes (skin.xml)
+
+    def remove_widget_includes(self, include_widget_id):
+        """Removes the <include> blocks that have <param name="widgetid" value="include_widget_id" />."""
+        if not os.path.exists(self.includes_file):
+            return
+        pattern = rf"<include\b(?:(?!<\/include>).)*?<param\s+name=\"widgetid\"\s+value=\"{re.escape(include_widget_id)}\".*?<\/include>"
+        new_xml, count = re.subn(pattern, "", self.get_includes(), flags=re.DOTALL | re.IGNORECASE)
+        if count:
+            self.includes       = new_xml
+            self.includes_dirty = True
+
+    # Commit / abort
+
+    def has_changes(self):
+        return bool(self.changes)
+
+    def preview(self):
+        """The pending changes, one per line."""
+        return "\n".join(self.changes)
+
+    def commit(self):
+        """
+        Writes every changed file: first all to temp files, then the list of
+        renames to COMMIT_FILE, then the renames. A crash before COMMIT_FILE
+        exists leaves the old files; after it, recover_commit() finishes the job.
+        """
+        files = []
+        if self.settings is not None and self.settings.dirty:
+            files.append((self.settings_file, self.settings.render()))
+        if self.properties_dirty:
+            files.append((self.properties_file, self.properties.to_json()))
+        if self.includes_dirty:
+            files.append((self.includes_file, self.includes))
+
+        renames = []
+        for path, content in files:
+            write_file(path + ".tmp", content)
+            renames.append((path + ".tmp", path))
+        if renames:
+            xbmcvfs.mkdirs(os.path.dirname(COMMIT_FILE))
+            write_file(COMMIT_FILE, json.dumps(renames))
+            for tmp_path, path in renames:
+                os.replace(tmp_path, path)
+            os.remove(COMMIT_FILE)
+
+        if self.settings is not None and self.settings.dirty:
+            self.settings.mark_saved()
+        self.properties_dirty = self.includes_dirty = False
+        self.changes = []
+
+    def abort(self):
+        """Throws all pending edits away."""
+        if self.settings is not None and self.settings.dirty:
+            self.settings.load()
+        self.properties = self.includes = None
+        self.properties_dirty = self.includes_dirty = False
+        self.changes = []
+
+def confirm_changes(session, heading):
+    """
+    Asks whether to save the session's pending changes (shown as a preview)
+    and commits or aborts it.
+    """
+    if not session.has_changes():
+        return
+    if xbmcgui.Dialog().yesno(heading, session.preview(), nolabel="Discard", yeslabel="Save"):
+        try:
+            session.commit()
+        except Exception as e:
+            xbmc.log(f"[Edit Session] Failed to save changes: {e}", xbmc.LOGERROR)
+            xbmcgui.Dialog().ok("Error", "Failed to save widget changes.")
+            session.abort()
+    else:
+        session.abort()
@@ -0,0 +1,15 @@
+import os
+
+def write_file(path, content):
+    """Writes the file and syncs it to disk before returning."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+
+def write_file_atomic(path, content):
+    """Writes the file through a synced temp file and rename, so a crash
+    leaves either the old or the new file."""
+    tmp_path = path + ".tmp"
+    write_file(tmp_path, content)
+    os.replace(tmp_path, path)
@@ -1,109 +1,9 @@
-import re
-import json
 import xbmc
 import xbmcgui
 import xbmcvfs
 
-# -----------------------------
-# Helper functions for HUB widgets (unchanged)
-# -----------------------------
-
-def clear_hub_properties_json(properties_file, slot_index):
-    """
-    Clears all property values for a home widget slot in the properties JSON file.
-    For the given slot, it empties the values for keys:
-       "widget", "widgetName", "widgetType", "widgetTarget", and "widgetPath".
-    For slot_index 1, keys have no suffix; for slot_index >= 2, keys have a suffix of ".{slot_index-1}".
-    """
-    try:
-        with open(properties_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        # Determine suffix based on slot index:
-        # slot_index 1 -> suffix = ""
-        # slot_index 2 -> suffix = ".1", slot_index 3 -> ".2", etc.
-        suffix = "" if slot_index == 1 else f".{slot_index - 1}"
-        keys_to_clear = ["widget", "widgetName", "widgetType", "widgetTarget", "widgetPath"]
-
-        for entry in data:
-            # Check for proper format: each entry should be a list with 4 elements.
-            if isinstance(entry, list) and len(entry) == 4:
-                if entry[0] == "mainmenu" and entry[1] == "10000":
-                    # For every key that should be cleared, if the third element matches key+suffix, clear the value.
-                    for key in keys_to_clear:
-                        if entry[2] == f"{key}{suffix}":
-                            # For debugging, you can uncomment the line below:
-                            # xbmc.log(f"Clearing entry for key: {entry[2]} in slot {slot_index}", xbmc.LOGERROR)
-                            entry[3] = ""
-        with open(properties_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4)
-    except Exception as e:
-        xbmc.log("Error clearing home widget properties: " + str(e), xbmc.LOGERROR)
-        xbmcgui.Dialog().ok("Error", "Failed to clear home widget properties.")
-
-def update_hub_properties_json(properties_file, slot_index, new_value, is_home_widget=False):
-    """
-    Updates the widgetName value for a widget slot in the JSON properties file.
-
-    For home widgets:
-      - The key is "widgetName" for slot 1 and "widgetName.{i-1}" thereafter.
-      
-    For hub widgets:
-      - The key will be prefixed with "hub." (i.e. "hub.widgetName" for slot 1 and
-        "hub.widgetName.{i-1}" for subsequent slots).
-      - If no such hub entry exists, a new one is appended without modifying any
-        existing home widget data.
-    """
-    try:
-        with open(properties_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        # Create a suffix: "" for slot 1, ".{slot_index-1}" for later slots.
-        suffix = "" if slot_index == 1 else f".{slot_index - 1}"
-        if is_home_widget:
-            target_key = "widgetName" + suffix
-        else:
-            target_key = "hub.widgetName" + suffix
-
-        updated = False
-        for entry in data:
-            if isinstance(entry, list) and len(entry) >= 4:
-                # Only update an entry that exactly matches the target key.
-                if entry[0] == "mainmenu" and entry[1] == "10000" and entry[2] == target_key:
-                    entry[3] = new_value
-                    updated = True
-                    break
-
-        # For hub widgets (is_home_widget == False): If no hub entry exists,
-        # do not fall back to legacy "widgetName". Instead, add a new entry.
-        if not updated and not is_home_widget:
-            data.append(["mainmenu", "10000", target_key, new_value])
-            updated = True
-
-        if not updated:
-            xbmcgui.Dialog().ok("Warning", f"No matching JSON entry found for key: {target_key}")
-        with open(properties_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4)
-    except Exception as e:
-        xbmc.log("Error updating hub JSON properties: " + str(e), xbmc.LOGERROR)
-        xbmcgui.Dialog().ok("Error", "Failed to update widget JSON properties.")
-
-def remove_widget_includes(skin_xml_file, widget_id):
-    """
-    Removes the <include> blocks from the skin XML file that contain a 
-    <param name="widgetid" value="widget_id" /> element.
-    """
-    try:
-        with open(skin_xml_file, "r", encoding="utf-8") as f:
-            xml_content = f.read()
-        pattern = rf"<include\b(?:(?!<\/include>).)*?<param\s+name=\"widgetid\"\s+value=\"{re.escape(widget_id)}\".*?<\/include>"
-        new_xml, count = re.subn(pattern, "", xml_content, flags=re.DOTALL | re.IGNORECASE)
-        if count == 0:
-            xbmcgui.Dialog().ok("Warning", f"No matching include blocks found for widgetid {widget_id}.")
-        with open(skin_xml_file, "w", encoding="utf-8") as f:
-            f.write(new_xml)
-    except Exception as e:
-        xbmc.log("Error removing widget includes: " + str(e), xbmc.LOGERROR)
-#        xbmcgui.Dialog().ok("Error", "Failed to remove widget includes.")
+from edit_session import EditSession
+from skin_properties import HOME_WIDGET_KEYS, SkinProperties
 
 # -----------------------------
 # New Home Widget Helpers (Dynamic Loader)
@@ -113,48 +13,17 @@ def get_home_widgets(properties_file):
     Dynamically loads home widgets from the properties file.
     The JSON is expected to be an array, where each entry is of the form:
          [ "mainmenu", "10000", key, value ]
-    We group entries by slot index: unsuffixed keys correspond to slot 0,
-    keys with ".N" suffix go to slot N.
+    Unsuffixed keys correspond to slot 0, keys with ".N" suffix go to slot N;
+    slots without entries are kept (empty), so list index N is always slot N.
     Returns a list of dictionaries, one per slot, containing keys:
          "widget", "widgetName", "widgetType", "widgetTarget", "widgetPath".
-    Only entries whose keys do NOT start with "hub." (i.e. home widgets) are loaded.
+    "hub." keys (hub widgets) are not loaded here.
     """
-    keys = ["widget", "widgetName", "widgetType", "widgetTarget", "widgetPath"]
     try:
         if not xbmcvfs.exists(properties_file):
             xbmcgui.Dialog().ok("Error", "Properties file not found:\n" + properties_file)
             return []
-        with open(properties_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        slots = {}  # dictionary keyed by slot index (integer)
-        for entry in data:
-            if (isinstance(entry, list) and len(entry) >= 4 and
-                entry[0] == "mainmenu" and entry[1] == "10000"):
-                full_key = entry[2]
-                value = entry[3]
-                # Skip any keys that start with "hub." so that hub widgets are not loaded here.
-                if full_key.startswith("hub."):
-                    continue
-                # Process home-widget key normally.
-                if "." in full_key:
-                    base, suffix = full_key.split(".", 1)
-                    try:
-                        idx = int(suffix)
-                    except Exception:
-                        idx = 0
-                else:
-                    base = full_key
-                    idx = 0
-
-                if base not in keys:
-                    continue
-                if idx not in slots:
-                    # Initialize slot with empty strings for each key.
-                    slots[idx] = {k: "" for k in keys}
-                slots[idx][base] = value
-        # Convert the dictionary to a list ordered by slot index.
-        widget_slots = [slots[i] for i in sorted(slots.keys())]
-        return widget_slots
+        return SkinProperties.load(properties_file).slots("mainmenu", "10000", HOME_WIDGET_KEYS)
     except Exception as e:
         xbmc.log("Error in get_home_widgets: " + str(e), xbmc.LOGERROR)
         xbmcgui.Dialog().ok("Error", "Failed to load home widgets.")
@@ -167,14 +36,10 @@ def rename_home_widget(settings_file, home_xml_file):
     """
     Provides a dialog workflow to rename a home widget.
     Loads home widgets from the properties file dynamically using get_home_widgets(),
-    then saves the updated set. After each rename attempt (successful or not),
-    the widget select menu is re-displayed.
+    then saves the new name through an edit session. After each rename attempt
+    (successful or not), the widget select menu is re-displayed.
     Empty slots are not offered for renaming.
     """
-    import xbmcgui
-    import json
-    import xbmcvfs
-
     # Define the path to the properties file.
     PROPERTIES_FILE = xbmcvfs.translatePath("special://userdata/addon_data/script.skinshortcuts/skin.nedflix.properties")
     dlg = xbmcgui.Dialog()
@@ -217,21 +82,14 @@ def rename_home_widget(settings_file, home_xml_file):
             continue
 
         # Update the selected widget with the new name.
-        widgets[actual_index]["widgetName"] = new_name
-
-        # Rebuild the JSON structure that represents all widget slots.
-        new_properties = []
-        keys = ["widget", "widgetName", "widgetType", "widgetTarget", "widgetPath"]
-        for idx, widget in enumerate(widgets):
-            suffix = "" if idx == 0 else f".{idx}"
-            for key in keys:
-                new_properties.append(["mainmenu", "10000", key + suffix, widget.get(key, "")])
-
+        session = None
         try:
-            with open(PROPERTIES_FILE, "w", encoding="utf-8") as f:
-                json.dump(new_properties, f, indent=4)
-            
+            session = EditSession(properties_file=PROPERTIES_FILE)
+            session.rename_home_widget(actual_index + 1, current_name, new_name)
+            session.commit()
         except Exception as e:
+            if session is not None:
+                session.abort()
             xbmc.log("Error saving home widgets: " + str(e), xbmc.LOGERROR)
             dlg.ok("Error", "Failed to save home widget changes.")
 
@@ -246,7 +104,6 @@ def delete_home_widget(settings_file, home_xml_file):
     No XML files are modified.
     After a successful deletion, the delete menu is automatically re-displayed.
     """
-    import xbmcgui, xbmcvfs, json
     PROPERTIES_FILE = xbmcvfs.translatePath("special://userdata/addon_data/script.skinshortcuts/skin.nedflix.properties")
     dlg = xbmcgui.Dialog()
 
@@ -289,7 +146,16 @@ def delete_home_widget(settings_file, home_xml_file):
         slot_index = actual_index + 1
 
         # Clear all properties for this widget slot.
-        clear_hub_properties_json(PROPERTIES_FILE, slot_index)
+        session = None
+        try:
+            session = EditSession(properties_file=PROPERTIES_FILE)
+            session.delete_home_widget(slot_index, current_name)
+            session.commit()
+        except Exception as e:
+            if session is not None:
+                session.abort()
+            xbmc.log("Error clearing home widget properties: " + str(e), xbmc.LOGERROR)
+            dlg.ok("Error", "Failed to clear home widget properties.")
 #        dlg.ok("Success", f"Home widget '{current_name}' deleted.")
 
         # After deletion, automatically loop back to the selection menu.
@@ -336,39 +202,22 @@ def rename_hub_widget(settings_file):
                 continue
             new_name = new_name.strip()
 
-            # Calculate the widget_id based on the actual_index.
-            widget_id = 510 + actual_index * 10 if actual_index < 9 else 5100
-
+            # settings.xml and the properties are written together
+            session = None
             try:
-                with open(settings_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                pattern = rf'(<setting id="{selected_hub}-{widget_id}\.label" type="string">)(.*?)(</setting>)'
-                new_content, count = re.subn(
-                    pattern,
-                    lambda m: m.group(1) + new_name + m.group(3),
-                    content,
-                    flags=re.DOTALL
-                )
-                if count == 0:
+                session = EditSession(settings_file)
+                if not session.rename_hub_widget(selected_hub, actual_index, new_name):
+                    session.abort()
                     dlg.ok("Error", "Widget label not found; unable to rename widget.")
                     continue
-                with open(settings_file, 'w', encoding='utf-8') as f:
-                    f.write(new_content)
+                session.commit()
             except Exception as e:
+                if session is not None:
+                    session.abort()
                 xbmc.log("Error renaming widget: " + str(e), xbmc.LOGERROR)
                 dlg.ok("Error", "Failed to rename widget.")
                 continue
 
-            # Define slot_index explicitly after the XML update.
-            slot_index = actual_index + 1
-            PROPERTIES_FILE = xbmcvfs.translatePath("special://userdata/addon_data/script.skinshortcuts/skin.nedflix.properties")
-            try:
-                update_hub_properties_json(PROPERTIES_FILE, slot_index, new_name, is_home_widget=False)
-            except Exception as e:
-                xbmc.log("Error updating hub JSON properties: " + str(e), xbmc.LOGERROR)
-                dlg.ok("Error", "Failed to update hub widget JSON properties.")
-                continue
-
             dlg.ok("Success", f"Renamed widget '{current_name}' to '{new_name}'")
             # Continue to allow additional renaming.
             continue
@@ -422,26 +271,18 @@ def delete_widget(settings_file, home_xml_file):
         if not xbmcgui.Dialog().yesno("Confirm Delete", f"Are you sure you want to delete '{current_name}'?"):
             continue
 
-        widget_id = 510 + actual_index * 10 if actual_index < 9 else 5100
+        # settings.xml, the properties and the includes are written together
+        session = None
         try:
-            with open(settings_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-
-            pattern = rf'\s*<setting id="{selected_hub}-{widget_id}\.(?:label|path|sortorder|sortby|LocalizedSortOrder|LocalizedSortBy|target)" type="string">.*?</setting>\s*'
-            new_content, count = re.subn(pattern, "", content, flags=re.DOTALL)
-            if count == 0:
+            session = EditSession(settings_file)
+            if not session.delete_hub_widget(selected_hub, actual_index, "2520"):  # Update if needed
+                session.abort()
                 xbmcgui.Dialog().ok("Error", "No widget settings were removed; unable to delete widget.")
                 continue
-
-            with open(settings_file, 'w', encoding='utf-8') as f:
-                f.write(new_content)
-
-            slot_index = actual_index + 1
-            PROPERTIES_FILE = xbmcvfs.translatePath("special://userdata/addon_data/script.skinshortcuts/skin.nedflix.properties")
-            update_hub_properties_json(PROPERTIES_FILE, slot_index, "")
-            SKIN_XML_FILE = xbmcvfs.translatePath("special://userdata/addon_data/script.skinshortcuts/skin.xml")
-            remove_widget_includes(SKIN_XML_FILE, "2520")  # Update if needed
+            session.commit()
         except Exception as e:
+            if session is not None:
+                session.abort()
             xbmc.log("Error deleting widget: " + str(e), xbmc.LOGERROR)
             xbmcgui.Dialog().ok("Error", "Failed to delete widget.")
             continue
@@ -494,39 +335,23 @@ def rename_widget(settings_file, home_xml_file):
             if new_name is None or new_name.strip() == "":
                 continue
             new_name = new_name.strip()
-            widget_id = 510 + actual_index * 10 if actual_index < 9 else 5100
 
+            # settings.xml and the properties are written together
+            session = None
             try:
-                with open(settings_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                # Use a lambda function for replacement to avoid backreference issues.
-                pattern = rf'(<setting id="{selected_hub}-{widget_id}\.label" type="string">)(.*?)(</setting>)'
-                new_content, count = re.subn(
-                    pattern,
-                    lambda m: m.group(1) + new_name + m.group(3),
-                    content,
-                    flags=re.DOTALL
-                )
-                if count == 0:
+                session = EditSession(settings_file)
+                if not session.rename_hub_widget(selected_hub, actual_index, new_name):
+                    session.abort()
                     xbmcgui.Dialog().ok("Error", "Widget label not found; unable to rename widget.")
                     continue
-                with open(settings_file, 'w', encoding='utf-8') as f:
-                    f.write(new_content)
+                session.commit()
             except Exception as e:
+                if session is not None:
+                    session.abort()
                 xbmc.log("Error renaming widget: " + str(e), xbmc.LOGERROR)
                 xbmcgui.Dialog().ok("Error", "Failed to rename widget.")
                 continue
 
-            # Define slot_index explicitly here.
-            slot_index = actual_index + 1
-            PROPERTIES_FILE = xbmcvfs.translatePath("special://userdata/addon_data/script.skinshortcuts/skin.nedflix.properties")
-            try:
-                update_hub_properties_json(PROPERTIES_FILE, slot_index, new_name, is_home_widget=False)
-            except Exception as e:
-                xbmc.log("Error updating hub JSON properties: " + str(e), xbmc.LOGERROR)
-                xbmcgui.Dialog().ok("Error", "Failed to update hub widget JSON properties.")
-                continue
-
 #            xbmcgui.Dialog().ok("Success", f"Renamed widget '{current_name}' to '{new_name}'")
             # Loop back to allow additional renames.
             continue
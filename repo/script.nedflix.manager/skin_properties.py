@@ -0,0 +1,99 @@
+import json
+
+# The skinshortcuts properties of one home widget slot
+HOME_WIDGET_KEYS = ["widget", "widgetName", "widgetType", "widgetTarget", "widgetPath"]
+
+def parse_slot_key(key):
+    """
+    Splits a property key into its base and slot number:
+    "widgetName" -> ("widgetName", 0), "widgetName.3" -> ("widgetName", 3).
+    """
+    base, dot, suffix = key.rpartition(".")
+    if dot and suffix.isdigit():
+        return base, int(suffix)
+    return key, 0
+
+def slot_key(base, slot):
+    """The opposite of parse_slot_key."""
+    return base if slot == 0 else f"{base}.{slot}"
+
+class SkinProperties:
+    """
+    skin.nedflix.properties, a JSON list of [group, id, key, value] entries,
+    indexed once by (group, id, key). Edits change the entries in place, so
+    saving keeps every other entry, and the file order, as it was.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.index   = {}
+        for entry in entries:
+            if isinstance(entry, list) and len(entry) >= 4:
+                self.index[(entry[0], entry[1], entry[2])] = entry
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def get(self, group, item_id, key, default=""):
+        entry = self.index.get((group, item_id, key))
+        return entry[3] if entry is not None else default
+
+    def has(self, group, item_id, key):
+        return (group, item_id, key) in self.index
+
+    def set(self, group, item_id, key, value):
+        """Sets a value, adding the entry if there is none."""
+        entry = self.index.get((group, item_id, key))
+        if entry is None:
+            entry = [group, item_id, key, value]
+            self.entries.append(entry)
+            self.index[(group, item_id, key)] = entry
+        else:
+            entry[3] = value
+
+    def slot_count(self, group, item_id, keys=HOME_WIDGET_KEYS):
+        """One more than the highest slot number used by any of keys."""
+        keys  = set(keys)
+        count = 0
+        for g, i, key in self.index:
+            if g == group and i == item_id:
+                base, slot = parse_slot_key(key)
+                if base in keys:
+                    count = max(count, slot + 1)
+        return count
+
+    def slots(self, group, item_id, keys=HOME_WIDGET_KEYS, minimum=0):
+        """
+        The values of keys per slot, as a list of dicts from slot 0 up to the
+        highest slot in use (at least minimum slots). Missing values are "".
+        """
+        keys  = set(keys)
+        slots = [dict.fromkeys(keys, "") for _ in range(max(minimum, self.slot_count(group, item_id, keys)))]
+        for (g, i, key), entry in self.index.items():
+            if g == group and i == item_id:
+                base, slot = parse_slot_key(key)
+                if base in keys:
+                    slots[slot][base] = entry[3]
+        return slots
+
+    def swap_slots(self, group, item_id, slot_a, slot_b, keys=HOME_WIDGET_KEYS):
+        for base in keys:
+            key_a, key_b = slot_key(base, slot_a), slot_key(base, slot_b)
+            value_a = self.get(group, item_id, key_a)
+            value_b = self.get(group, item_id, key_b)
+            if self.has(group, item_id, key_a) or value_b:
+                self.set(group, item_id, key_a, value_b)
+            if self.has(group, item_id, key_b) or value_a:
+                self.set(group, item_id, key_b, value_a)
+
+    def clear_slot(self, group, item_id, slot, keys=HOME_WIDGET_KEYS):
+        """Empties the values of a slot, keeping its entries."""
+        for base in keys:
+            entry = self.index.get((group, item_id, slot_key(base, slot)))
+            if entry is not None:
+                entry[3] = ""
+
+    def to_json(self):
+        return json.dumps(self.entries, indent=4)
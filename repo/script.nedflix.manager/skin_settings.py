@@ -0,0 +1,186 @@
+import os
+import re
+import xbmc
+import xbmcgui
+from xml.sax.saxutils import escape, unescape
+
+from file_utils import write_file_atomic
+
+# Every <setting> element of the skin's settings.xml
+SETTING_PATTERN = re.compile(
+    r'<setting\s+id="(?P<id>[^"]*)"(?P<attrs>[^>]*?)(?:/>|>(?P<value>.*?)</setting>)',
+    re.DOTALL
+)
+# Hub widget settings, e.g. bingiehub-moviesaddon-520.label
+HUB_SETTING_PATTERN = re.compile(r'^(bingiehub-[^-]+)-(\d+)\.(.+)$')
+
+# Entities TinyXML writes into settings.xml besides &amp; &lt; &gt;
+XML_ENTITIES = {"&apos;": "'", "&quot;": '"'}
+XML_CHARACTERS = {"'": "&apos;", '"': "&quot;"}
+
+# The string settings that make up one hub widget
+WIDGET_FIELDS = ["path", "label", "sortorder", "sortby", "LocalizedSortOrder", "LocalizedSortBy", "target"]
+WIDGET_SLOTS = 10
+
+def widget_id(index):
+    """Widget id of the hub slot at index (0-9): 510, 520 ... 590, 5100."""
+    return 510 + index * 10 if index < 9 else 5100
+
+class Setting:
+    """
+    One <setting> element. Its original text is written back untouched
+    unless its value was changed.
+    """
+
+    def __init__(self, setting_id, attrs, value, raw):
+        self.id      = setting_id
+        self.attrs   = attrs
+        self.value   = unescape(value or "", XML_ENTITIES)
+        self.raw     = raw
+        self.changed = False
+
+    def is_string(self):
+        return 'type="string"' in self.attrs
+
+    def set(self, value):
+        if value != self.value:
+            self.value   = value
+            self.changed = True
+
+    def render(self):
+        if not self.changed:
+            return self.raw
+        return f'<setting id="{self.id}"{self.attrs}>{escape(self.value, XML_CHARACTERS)}</setting>'
+
+class SkinSettings:
+    """
+    The skin's settings.xml parsed once, with the hub widget settings indexed
+    by (hub, widget id, field). Edits change the model in place; save() writes
+    the whole file once, atomically, keeping everything that wasn't edited
+    exactly as it was.
+    """
+
+    def __init__(self, path):
+        self.path  = path
+        self.parts = []  # text between settings and Setting objects, in file order
+        self.index = {}  # (hub, widget_id, field): Setting
+        self.dirty = False
+        self.mtime = None
+        self.load()
+
+    def load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        self.mtime = os.stat(self.path).st_mtime_ns
+        self.parts, self.index, self.dirty = [], {}, False
+
+        pos = 0
+        for m in SETTING_PATTERN.finditer(content):
+            self.parts.append(content[pos:m.start()])
+            setting = Setting(m.group('id'), m.group('attrs'), m.group('value'), m.group(0))
+            self.parts.append(setting)
+            pos = m.end()
+
+            hub_match = HUB_SETTING_PATTERN.match(setting.id)
+            if hub_match and setting.is_string():
+                hub, wid, field = hub_match.groups()
+                self.index[(hub, int(wid), field)] = setting
+        self.parts.append(content[pos:])
+
+    def hubs(self):
+        """Hub ids that have widget labels, sorted."""
+        return sorted({hub for hub, wid, field in self.index if field == "label"})
+
+    def get(self, hub, wid, field, default=""):
+        setting = self.index.get((hub, wid, field))
+        return setting.value if setting is not None else default
+
+    def set(self, hub, wid, field, value):
+        """Changes an existing setting, returns False if there is none."""
+        setting = self.index.get((hub, wid, field))
+        if setting is None:
+            return False
+        setting.set(value)
+        self.dirty = self.dirty or setting.changed
+        return True
+
+    def swap(self, hub, wid_a, wid_b, fields=WIDGET_FIELDS):
+        """Swaps the fields of two widget slots that both have them."""
+        for field in fields:
+            a = self.index.get((hub, wid_a, field))
+            b = self.index.get((hub, wid_b, field))
+            if a is not None and b is not None:
+                value_a, value_b = a.value, b.value
+                a.set(value_b)
+                b.set(value_a)
+                self.dirty = self.dirty or a.changed or b.changed
+
+    def delete(self, hub, wid, fields=WIDGET_FIELDS):
+        """Removes the settings of a widget slot, returns how many were removed."""
+        removed = 0
+        for field in fields:
+            setting = self.index.pop((hub, wid, field), None)
+            if setting is None:
+                continue
+            i = self.parts.index(setting)
+            # Take the line's indentation and newline with it
+            self.parts[i - 1] = self.parts[i - 1].rstrip(" \t")
+            if self.parts[i - 1].endswith("\n"):
+                self.parts[i - 1] = self.parts[i - 1][:-1]
+            del self.parts[i]
+            removed += 1
+        self.dirty = self.dirty or removed > 0
+        return removed
+
+    def widget_names(self, hub):
+        """Labels of the hub's widget slots, with a placeholder for empty ones."""
+        names = []
+        for i in range(WIDGET_SLOTS):
+            label = self.get(hub, widget_id(i), "label").strip()
+            names.append(label if label else f"Slot {i+1} (No widget assigned)")
+        return names
+
+    def render(self):
+        return ''.join(part if isinstance(part, str) else part.render() for part in self.parts)
+
+    def save(self):
+        """Writes the file if anything changed, through a temp file and rename."""
+        if not self.dirty:
+            return
+        write_file_atomic(self.path, self.render())
+        self.mark_saved()
+
+    def mark_saved(self):
+        """What was rendered is on disk now and becomes the new original."""
+        for part in self.parts:
+            if not isinstance(part, str) and part.changed:
+                part.raw     = part.render()
+                part.changed = False
+        self.dirty = False
+        self.mtime = os.stat(self.path).st_mtime_ns
+
+# One model per file for all menu actions, reloaded only when the file changed
+_cache = {}
+
+def get_skin_settings(path):
+    """
+    The shared SkinSettings for path. If the file changed on disk it is read
+    again; unsaved edits are dropped then, so they can't be written over the
+    newer file.
+    """
+    model = _cache.get(path)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError as e:
+        xbmc.log(f"Skin settings not found: {path}: {e}", xbmc.LOGERROR)
+        raise
+    if model is None or model.mtime != mtime:
+        if model is not None and model.dirty:
+            xbmc.log(f"Skin settings changed on disk, dropped unsaved edits: {path}", xbmc.LOGWARNING)
+            xbmcgui.Dialog().notification(
+                "Skin Settings", "Settings changed on disk, unsaved widget edits were discarded",
+                xbmcgui.NOTIFICATION_WARNING
+            )
+        model = SkinSettings(path)
+        _cache[path] = model
+    return model
@@ -0,0 +1,170 @@
+import re
+from xml.sax.saxutils import escape, unescape
+
+from file_utils import write_file_atomic
+
+# Comments, CDATA, <?...?> and <!...> are skipped, every other match is a tag
+TOKEN_PATTERN = re.compile(
+    r'<!--.*?-->|<!\[CDATA\[.*?\]\]>|<\?.*?\?>|<!.*?>'
+    r'|<(?P<close>/)?(?P<tag>[^\s/>!?]+)'
+    r'(?P<attrs>(?:\s+[^\s=/>]+\s*=\s*(?:"[^"]*"|\'[^\']*\'))*)\s*(?P<selfclose>/)?>',
+    re.DOTALL
+)
+ATTR_PATTERN = re.compile(r'([^\s=/>]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+
+class Element:
+    """
+    One element of a skin XML file with the offsets of its start tag,
+    content and attribute values, so edits can be made on the original text.
+    """
+
+    def __init__(self, tag, parent, start, attrs_end):
+        self.tag           = tag
+        self.parent        = parent
+        self.start         = start
+        self.attrs_end     = attrs_end  # where a new attribute is inserted
+        self.attrs         = {}
+        self.attr_spans    = {}         # name: (start, end) of the value
+        self.children      = []
+        self.content_start = None       # None for self-closing elements
+        self.content_end   = None
+        self.content       = ""
+
+    def get(self, name, default=None):
+        return self.attrs.get(name, default)
+
+    @property
+    def text(self):
+        """The unescaped content, "" for elements with child elements."""
+        return "" if self.children else unescape(self.content).strip()
+
+    def iter(self, tag=None):
+        """Every descendant element in file order, optionally only of one tag."""
+        for child in self.children:
+            if tag is None or child.tag == tag:
+                yield child
+            yield from child.iter(tag)
+
+    def find_all(self, tag=None, **attrs):
+        """Descendants of tag whose attributes have the given values."""
+        return [
+            element for element in self.iter(tag)
+            if all(element.get(name) == value for name, value in attrs.items())
+        ]
+
+    def find(self, tag=None, **attrs):
+        found = self.find_all(tag, **attrs)
+        return found[0] if found else None
+
+    def child(self, tag):
+        """The first direct child of tag."""
+        return next((child for child in self.children if child.tag == tag), None)
+
+    def child_text(self, tag, default=""):
+        child = self.child(tag)
+        return child.text if child is not None else default
+
+    def param(self, name):
+        """The <param name="..."> directly inside this element (an include)."""
+        return next((child for child in self.children if child.tag == "param" and child.get("name") == name), None)
+
+class SkinXml:
+    """
+    A skin XML file parsed in one pass into Elements that keep their offsets.
+    Targets are found by anchor (include name, control id, param name, ...)
+    instead of line numbers. Edits are collected and applied to the original
+    text in one pass on render(), so everything that wasn't edited is written
+    back byte for byte.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.load()
+
+    def load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            self.parse(f.read())
+
+    def parse(self, content):
+        self.content = content
+        self.edits   = {}  # (start, end): replacement
+        self.root    = Element(None, None, 0, 0)
+        self.root.content_start = 0
+
+        stack = [self.root]
+        for m in TOKEN_PATTERN.finditer(content):
+            tag = m.group("tag")
+            if tag is None:
+                continue
+            if m.group("close"):
+                # Tolerate unbalanced tags: close up to the matching element
+                for i in range(len(stack) - 1, 0, -1):
+                    if stack[i].tag == tag:
+                        for element in stack[i:]:
+                            element.content_end = m.start()
+                            if not element.children:
+                                element.content = content[element.content_start:m.start()]
+                        del stack[i:]
+                        break
+                continue
+
+            element = Element(tag, stack[-1], m.start(), m.end("attrs"))
+            for a in ATTR_PATTERN.finditer(m.group("attrs")):
+                value_group = 2 if a.group(2) is not None else 3
+                offset = m.start("attrs")
+                element.attrs[a.group(1)]      = unescape(a.group(value_group), {"&quot;": '"'})
+                element.attr_spans[a.group(1)] = (offset + a.start(value_group), offset + a.end(value_group))
+            stack[-1].children.append(element)
+            if not m.group("selfclose"):
+                element.content_start = m.end()
+                stack.append(element)
+        self.root.content_end = len(content)
+
+    # Anchors
+
+    def include(self, name):
+        """The <include name="..."> definition."""
+        return self.root.find("include", name=name)
+
+    def control(self, control_id):
+        """The <control id="..."> with the given id."""
+        return self.root.find("control", id=str(control_id))
+
+    # Edits
+
+    def set_text(self, element, value):
+        """Replaces the content of an element without child elements."""
+        if element.children or element.content_start is None:
+            return False
+        self.edits[(element.content_start, element.content_end)] = escape(value)
+        return True
+
+    def set_attr(self, element, name, value):
+        """Sets an attribute's value, adding the attribute if there is none."""
+        value = escape(value, {'"': "&quot;"})
+        if name in element.attr_spans:
+            self.edits[element.attr_spans[name]] = value
+        else:
+            self.edits[(element.attrs_end, element.attrs_end)] = f' {name}="{value}"'
+
+    @property
+    def dirty(self):
+        return bool(self.edits)
+
+    def render(self):
+        parts = []
+        pos   = 0
+        for (start, end), replacement in sorted(self.edits.items()):
+            parts.append(self.content[pos:start])
+            parts.append(replacement)
+            pos = end
+        parts.append(self.content[pos:])
+        return "".join(parts)
+
+    def save(self):
+        """Writes the file if anything changed, through a temp file and rename."""
+        if not self.dirty:
+            return
+        content = self.render()
+        write_file_atomic(self.path, content)
+        self.parse(content)
@@ -0,0 +1,169 @@
+import os
+import re
+import json
+import xbmc
+import xbmcaddon
+import xbmcvfs
+
+from file_utils import write_file_atomic
+
+# Available themes as tuples: (Display Label, Logo Image Path, Diffuse Hex Code)
+LOGO_OPTIONS = [
+    ("Red (Default)",                   "home/bingie_logo.png",                     "e50914"),
+    ("Yellow",                          "home/bingie_logo_yellow.png",              "e5c709"),
+    ("Yellow (Smiler)",                 "home/bingie_logo_yellow2.png",             "ffec00"),
+    ("Blue (Prime Video)",              "home/bingie_logo_blue.png",                "0679fd"),
+    ("Pink (iPlayer)",                  "home/bingie_logo_pink.png",                "ff4c98"),
+    ("Turquoise",                       "home/bingie_logo_turquoise.png",           "45b8ac"),
+    ("Sunlight",                        "home/bingie_logo_sunlight.png",            "edd59e"),
+    ("Orange",                          "home/bingie_logo_orange.png",              "ffa00a"),
+    ("Orange (Rec Room)",               "home/bingie_logo_orange2.png",             "ff6727"),
+    ("Green",                           "home/bingie_logo_green.png",               "1dd72f"),
+    ("Light Green (Channel 4)",         "home/bingie_logo_light_green.png",         "aaff89"),
+    ("Aqua (Kodi)",                     "home/bingie_logo_aqua.png",                "2ba7d7"),
+    ("Aqua 2",                          "home/bingie_logo_aqua2.png",               "01ffff"),
+    ("Peach Fuzz",                      "home/bingie_logo_peach_fuzz.png",          "ffbe98"),
+    ("Purple",                          "home/bingie_logo_purple.png",              "a515ff"),
+    ("Purple (GOG)",                    "home/bingie_logo_purple2.png",             "6900d1"),
+    ("Dedflix",                         "home/bingie_logo_dedflix.png",             "c20c0c"),
+    ("Dedflix (Orange)",                "home/bingie_logo_dedflix2.png",            "fb7e07"),
+    ("Nedflix",                         "home/bingie_logo_nedflix.png",             "1ed760")
+]
+
+# The theme colour skin strings, also updated in the theme file.
+# Add or remove keys as needed.
+THEME_KEYS = [
+    "WatchedIndicator.Watched.Color.base",
+    "BingieProgressBarColor.base",
+    "WatchedIndicator.Episodes.Color",
+    "SpinnerTextureColor.base",
+    "LineUnderMenuIconsColor.base",
+    "lineundermenuiconscolor",
+    "BingieOSDProgressBarColor.base",
+    "BingieProgressBarColor",
+    "WatchedIndicator.Episodes.Color.base",
+    "WatchedIndicator.Watched.Color",
+    "OSDVolumeButtonColor.base",
+    "BingieNewEpisodesTagColor.base",
+    "WatchedIndicator.Progress.Color.base",
+    "bingienewepisodestagcolor",
+    "ActiveSpinControlColor",
+    "SpinnerTextureColor",
+    "WatchedIndicator.Progress.Color",
+    "ActiveSpinControlColor.base",
+    "OSDBufferingSpinnerColor.base",
+    "bingieosdprogressbarcolor",
+    "OSDVolumeButtonColor",
+    "osdbufferingspinnercolor",
+]
+
+# Skin strings behind the $VAR[BingieThemeLogo] and $VAR[BingieThemeColor] skin variables
+LOGO_STRING  = "BingieThemeLogo"
+COLOR_STRING = "BingieThemeColor"
+
+SKIN_PATH       = "special://home/addons/skin.nedflix/"
+THEME_FILE      = xbmcvfs.translatePath(SKIN_PATH + "extras/skinthemes/Update Theme.theme")
+# Skin files and the variables they show the logo and colour through
+VARIABLE_FILES  = {
+    xbmcvfs.translatePath(SKIN_PATH + "1080i/IncludesHomeBingie.xml"):         [LOGO_STRING, COLOR_STRING],
+    xbmcvfs.translatePath(SKIN_PATH + "1080i/Custom_1159_MPAATopBar.xml"):     [COLOR_STRING],
+}
+
+BUNDLE_DIR = os.path.join(
+    xbmcvfs.translatePath(xbmcaddon.Addon(id='script.nedflix.manager').getAddonInfo('profile')),
+    "themes"
+)
+INDEX_FILE = os.path.join(BUNDLE_DIR, "index.json")
+
+# ('string', 'KEY', 'XXXXXXXX') tuples of the theme keys, every occurrence
+THEME_KEY_PATTERN = re.compile(
+    r"(\('string',\s*'(?:" + "|".join(re.escape(key) for key in THEME_KEYS) + r")'\s*,\s*')[0-9A-Fa-f]{8}(')"
+)
+
+def get_bundle_version():
+    """Bundles are compiled again when the skin or this addon is updated."""
+    manager_version = xbmcaddon.Addon(id='script.nedflix.manager').getAddonInfo('version')
+    try:
+        skin_version = xbmcaddon.Addon(id='skin.nedflix').getAddonInfo('version')
+    except Exception:
+        skin_version = ""
+    return f"{skin_version}/{manager_version}"
+
+def skin_has_theme_variables():
+    """True if the installed skin shows the logo and colour through skin strings."""
+    try:
+        for path, variables in VARIABLE_FILES.items():
+            with open(path, "r", encoding="utf-8") as f:
+                content = f.read()
+            if any(f"$VAR[{variable}]" not in content for variable in variables):
+                return False
+    except OSError:
+        return False
+    return True
+
+def render_theme_file(template, diffuse_hex):
+    """The theme file with every theme key set to the colour, in one pass."""
+    return THEME_KEY_PATTERN.sub(lambda m: m.group(1) + "ff" + diffuse_hex + m.group(2), template)
+
+def compile_bundles(version):
+    """
+    Pre-renders every theme into BUNDLE_DIR: the skin strings it sets and
+    a ready-made copy of the theme file. index.json is written last, so a
+    compile that was cut short is simply redone.
+    """
+    template = None
+    if os.path.exists(THEME_FILE):
+        with open(THEME_FILE, "r", encoding="utf-8") as f:
+            template = f.read()
+
+    xbmcvfs.mkdirs(BUNDLE_DIR)
+    bundles = []
+    for i, (label, logo_path, diffuse_hex) in enumerate(LOGO_OPTIONS):
+        color   = "ff" + diffuse_hex
+        strings = {key: color for key in THEME_KEYS}
+        strings[LOGO_STRING]  = logo_path
+        strings[COLOR_STRING] = color
+        theme_file = None
+        if template is not None:
+            theme_file = f"{i}.theme"
+            write_file_atomic(os.path.join(BUNDLE_DIR, theme_file), render_theme_file(template, diffuse_hex))
+        bundles.append({
+            "label":      label,
+            "logo":       logo_path,
+            "hex":        diffuse_hex,
+            "strings":    strings,
+            "theme_file": theme_file,
+        })
+
+    index = {
+        "version":        version,
+        "skin_variables": skin_has_theme_variables(),
+        "bundles":        bundles,
+    }
+    write_file_atomic(INDEX_FILE, json.dumps(index, indent=4))
+    xbmc.log(f"[Theme Bundles] Compiled {len(bundles)} themes ({version})", xbmc.LOGINFO)
+    return index
+
+def get_theme_bundles():
+    """The compiled themes, compiled once per installed version."""
+    version = get_bundle_version()
+    try:
+        with open(INDEX_FILE, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("version") == version and len(index.get("bundles", [])) == len(LOGO_OPTIONS):
+            return index
+    except (OSError, ValueError):
+        pass
+    return compile_bundles(version)
+
+def apply_bundle(bundle):
+    """
+    Sets the theme's skin strings, which the skin picks up right away, and
+    swaps the pre-rendered theme file into the skin so that applying the
+    theme from the skin's settings gives the same colours.
+    """
+    for key, value in bundle["strings"].items():
+        xbmc.executebuiltin(f"Skin.SetString({key},{value})")
+    if bundle["theme_file"] and os.path.exists(THEME_FILE):
+        with open(os.path.join(BUNDLE_DIR, bundle["theme_file"]), "r", encoding="utf-8") as f:
+            write_file_atomic(THEME_FILE, f.read())
@@ -0,0 +1,69 @@
+import os
+import sys
+import types
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for addon in ("script.nedflix.manager", "script.local-resume"):
+    sys.path.insert(0, os.path.join(ROOT, "repo", addon))
+
+PROFILE = tempfile.mkdtemp(prefix="nedflix-profile-")
+
+def _kodi_modules():
+    """Just enough of the Kodi modules to import the addons outside Kodi."""
+    xbmc = types.ModuleType("xbmc")
+    for i, name in enumerate(["LOGDEBUG", "LOGINFO", "LOGWARNING", "LOGERROR", "LOGFATAL"]):
+        setattr(xbmc, name, i)
+    xbmc.log            = lambda msg, level=0: None
+    xbmc.executebuiltin = lambda builtin, wait=False: None
+    xbmc.getCondVisibility = lambda condition: False
+    xbmc.sleep          = lambda ms: None
+    xbmc.Player         = type("Player", (), {"__init__": lambda self, *a, **k: None})
+    xbmc.Monitor        = type("Monitor", (), {
+        "__init__": lambda self, *a, **k: None,
+        "abortRequested": lambda self: False,
+        "waitForAbort": lambda self, timeout=0: False,
+    })
+
+    xbmcaddon = types.ModuleType("xbmcaddon")
+    class Addon:
+        def __init__(self, id=None):
+            pass
+        def getSetting(self, key):
+            return ""
+        def getSettingBool(self, key):
+            return False
+        def getSettingInt(self, key):
+            return 0
+        def getAddonInfo(self, key):
+            return {"profile": PROFILE, "path": ROOT, "version": "0"}.get(key, "")
+    xbmcaddon.Addon = Addon
+
+    xbmcvfs = types.ModuleType("xbmcvfs")
+    xbmcvfs.translatePath = lambda path: path
+    xbmcvfs.exists        = os.path.exists
+    xbmcvfs.mkdirs        = lambda path: os.makedirs(path, exist_ok=True)
+
+    xbmcgui = types.ModuleType("xbmcgui")
+    class Window:
+        properties = {}
+        def __init__(self, window_id=None):
+            pass
+        def getProperty(self, key):
+            return self.properties.get(key, "")
+        def setProperty(self, key, value):
+            self.properties[key] = value
+        def clearProperty(self, key):
+            self.properties.pop(key, None)
+    xbmcgui.Window = Window
+    xbmcgui.NOTIFICATION_INFO, xbmcgui.NOTIFICATION_WARNING, xbmcgui.NOTIFICATION_ERROR = "info", "warning", "error"
+    xbmcgui.Dialog = type("Dialog", (), {"notification": lambda self, *a, **k: None})
+    xbmcgui.ListItem = type("ListItem", (), {"__init__": lambda self, *a, **k: None})
+
+    xbmcplugin = types.ModuleType("xbmcplugin")
+    return {"xbmc": xbmc, "xbmcaddon": xbmcaddon, "xbmcvfs": xbmcvfs, "xbmcgui": xbmcgui, "xbmcplugin": xbmcplugin}
+
+try:
+    import xbmc  # noqa: F401
+except ImportError:
+    sys.modules.update(_kodi_modules())
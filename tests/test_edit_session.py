@@ -0,0 +1,36 @@
+import shutil
+
+import pytest
+
+import edit_session
+from edit_session import EditSession
+from skin_settings import get_skin_settings
+from test_skin_settings import BACKUP_SETTINGS
+
+@pytest.fixture
+def settings_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(edit_session, "COMMIT_FILE", str(tmp_path / "pending_commit.json"))
+    path = str(tmp_path / "settings.xml")
+    shutil.copyfile(BACKUP_SETTINGS, path)
+    return path
+
+def test_delete_hub_widget_leaves_settings_alone_when_properties_fail(tmp_path, settings_file):
+    session = EditSession(settings_file, properties_file=str(tmp_path / "missing.properties"))
+    with pytest.raises(OSError):
+        session.delete_hub_widget("bingiehub-moviesaddon", 0, "2520")
+    model = get_skin_settings(settings_file)
+    assert not model.dirty
+    assert model.get("bingiehub-moviesaddon", 510, "label")
+
+def test_abort_after_failed_commit_drops_the_edit(tmp_path, settings_file):
+    session = EditSession(settings_file, properties_file=str(tmp_path / "missing" / "skin.nedflix.properties"))
+    old_name = session.settings.get("bingiehub-moviesaddon", 510, "label")
+    session.settings.set("bingiehub-moviesaddon", 510, "label", "Renamed")
+    session.properties_dirty = True
+    session.properties = edit_session.SkinProperties([])
+    with pytest.raises(OSError):
+        session.commit()
+    session.abort()
+    model = get_skin_settings(settings_file)
+    assert not model.dirty
+    assert model.get("bingiehub-moviesaddon", 510, "label") == old_name
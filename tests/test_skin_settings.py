@@ -0,0 +1,58 @@
+import os
+import shutil
+
+from conftest import ROOT
+from skin_settings import SkinSettings, get_skin_settings
+
+BACKUP_SETTINGS = os.path.join(
+    ROOT, "repo", "skin.nedflix", "nedflix images & backups", "addon_data backup", "skin.nedflix", "settings.xml"
+)
+
+def test_swap_and_save_keeps_apos_entity(tmp_path):
+    path = str(tmp_path / "settings.xml")
+    shutil.copyfile(BACKUP_SETTINGS, path)
+    with open(path, encoding="utf-8") as f:
+        original = f.read()
+
+    settings = SkinSettings(path)
+    value_550 = settings.get("bingiehub-moviesaddon", 550, "path")
+    value_560 = settings.get("bingiehub-moviesaddon", 560, "path")
+    assert "RottenTomatoes.com's" in value_550
+
+    settings.swap("bingiehub-moviesaddon", 550, 560)
+    settings.save()
+
+    with open(path, encoding="utf-8") as f:
+        content = f.read()
+    assert "&amp;apos;" not in content
+    assert "RottenTomatoes.com&apos;s" in content
+
+    reloaded = SkinSettings(path)
+    assert reloaded.get("bingiehub-moviesaddon", 560, "path") == value_550
+    assert reloaded.get("bingiehub-moviesaddon", 550, "path") == value_560
+
+    # Swapping back gives the original file
+    reloaded.swap("bingiehub-moviesaddon", 550, 560)
+    reloaded.save()
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == original
+
+def test_dirty_model_is_reloaded_when_the_file_changed(tmp_path):
+    path = str(tmp_path / "settings.xml")
+    shutil.copyfile(BACKUP_SETTINGS, path)
+    model = get_skin_settings(path)
+    old_name = model.get("bingiehub-moviesaddon", 510, "label")
+    model.set("bingiehub-moviesaddon", 510, "label", "Unsaved")
+
+    # Written by Kodi in the meantime
+    external = SkinSettings(path)
+    external.set("bingiehub-moviesaddon", 520, "label", "External")
+    external.save()
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, model.mtime + 1))
+
+    reloaded = get_skin_settings(path)
+    assert reloaded is not model
+    assert not reloaded.dirty
+    assert reloaded.get("bingiehub-moviesaddon", 510, "label") == old_name
+    assert reloaded.get("bingiehub-moviesaddon", 520, "label") == "External"
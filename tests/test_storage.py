@@ -0,0 +1,63 @@
+import threading
+import time
+
+import pytest
+
+import storage
+from storage import JsonStore, ResumeJournal, SqliteStore
+
+def test_append_after_torn_tail_keeps_new_record(tmp_path):
+    journal = ResumeJournal(str(tmp_path / "resume_points.json"))
+    journal.append([("a", 10, 1, 0)])
+    with open(journal.journal_path, "a", encoding="utf-8") as f:
+        f.write('{"k": "b", "p": 2')  # cut short by a power loss
+
+    journal = ResumeJournal(str(tmp_path / "resume_points.json"))
+    positions, updated, totals = journal.load()
+    assert positions == {"a": 10}
+    journal.append([("c", 30, 3, 0)])
+
+    positions, updated, totals = ResumeJournal(str(tmp_path / "resume_points.json")).read()
+    assert positions == {"a": 10, "c": 30}
+    assert updated["c"] == 3
+
+def test_evict_keeps_key_saved_between_selection_and_removal(tmp_path, monkeypatch):
+    store = JsonStore(str(tmp_path))
+    store.save_resume_points([("old", 100, 1, 0), ("new", 200, time.time(), 0)])
+
+    select_evicted     = storage.select_evicted
+    save_resume_points = store.save_resume_points
+    writer = threading.Thread(target=save_resume_points, args=([("old", 500, time.time(), 0)],))
+
+    def select_then_update(entries, *args, **kwargs):
+        drop = select_evicted(entries, *args, **kwargs)
+        if writer.ident is None:
+            # The playback thread refreshes a key the eviction is about to remove
+            writer.start()
+        return drop
+
+    def save_after_update(records):
+        if any(position is None for key, position, ts, total in records):
+            # Give the update every chance to land before the removal
+            writer.join(0.5)
+        save_resume_points(records)
+
+    monkeypatch.setattr(storage, "select_evicted", select_then_update)
+    monkeypatch.setattr(store, "save_resume_points", save_after_update)
+    removed, _ = store.evict(max_entries=1)
+    writer.join()
+
+    assert removed == 1
+    assert store.get_resume_point("old") == 500
+    assert JsonStore(str(tmp_path)).get_resume_point("old") == 500
+    store.close()
+
+@pytest.mark.parametrize("store_class", [JsonStore, SqliteStore])
+def test_total_is_kept_with_the_resume_point(tmp_path, store_class):
+    store = store_class(str(tmp_path))
+    store.save_resume_points([("a", 100, 1, 1800)])
+    store.close()
+
+    store = store_class(str(tmp_path))
+    assert store.in_progress() == [("a", 100, 1, 1800)]
+    store.close()